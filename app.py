@@ -1,22 +1,81 @@
 import os
+import copy
+import cProfile
+import csv
+import heapq
+import io
+import ipaddress
+import itertools
+import json
 import math
+import pstats
+import queue
+import tempfile
+import threading
+import time
+import unicodedata
 import urllib.parse
+import uuid
 import re
+import sys
 
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import wraps
+import click
+import gridfs
 from flask import (
     Flask,
+    abort,
     flash,
+    g,
+    has_request_context,
+    jsonify,
+    make_response,
     render_template,
     redirect,
     request,
+    send_file,
     session,
+    stream_with_context,
     url_for,
 )
 from flask_pymongo import PyMongo
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from pymongo import (
+    ASCENDING,
+    DESCENDING,
+    CursorType,
+    ReplaceOne,
+    ReturnDocument,
+    UpdateOne,
+    monitoring,
+)
+from pymongo.collation import Collation
+from pymongo.errors import (
+    BulkWriteError,
+    CollectionInvalid,
+    ConnectionFailure,
+    DuplicateKeyError,
+    PyMongoError,
+)
+from bson import json_util
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
+from werkzeug.http import is_resource_modified
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import check_password_hash, generate_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 if os.path.exists("env.py"):
     import env
@@ -24,11 +83,437 @@ if os.path.exists("env.py"):
 
 app = Flask(__name__)
 
+
+def gevent_patched():
+    """
+    Returns True if gevent has patched the standard library, as gunicorn's
+    gevent workers do before loading the app. Threads are then greenlets
+    sharing one OS thread.
+    """
+    monkey = sys.modules.get("gevent.monkey")
+    return bool(monkey and monkey.is_module_patched("threading"))
+
+
 app.config["MONGO_DBNAME"] = os.environ.get("MONGO_DBNAME")
 app.config["MONGO_URI"] = os.environ.get("MONGO_URI")
+app.config["ENSURE_INDEXES"] = os.environ.get("ENSURE_INDEXES", "1") != "0"
+app.config["LEADERBOARD_PAGE_SIZE"] = int(
+    os.environ.get("LEADERBOARD_PAGE_SIZE", 100)
+)
+app.config["LEADERBOARD_MAX_PAGE_SIZE"] = 500
+app.config["ADMIN_PAGE_SIZE"] = int(os.environ.get("ADMIN_PAGE_SIZE", 20))
+app.config["PAGE_CACHE_SIZE"] = int(os.environ.get("PAGE_CACHE_SIZE", 256))
+app.config["PAGE_CACHE_TTL"] = int(os.environ.get("PAGE_CACHE_TTL", 300))
+app.config["RANK_INDEX_MAX_ROWS"] = int(
+    os.environ.get("RANK_INDEX_MAX_ROWS", 250000)
+)
+app.config["EXPORT_BATCH_SIZE"] = int(
+    os.environ.get("EXPORT_BATCH_SIZE", 1000)
+)
+app.config["CASCADE_BATCH_SIZE"] = int(
+    os.environ.get("CASCADE_BATCH_SIZE", 1000)
+)
+# compaction rewrites data, so it needs an explicit true value to turn on
+app.config["COMPACT_SCORES"] = os.environ.get(
+    "COMPACT_SCORES", ""
+).lower() in ("1", "true", "yes", "on")
+# under gevent a CPU-bound job would block every request in the worker, so
+# jobs are left to flask run-jobs unless asked for
+app.config["JOB_WORKERS"] = int(
+    os.environ.get("JOB_WORKERS", 0 if gevent_patched() else 2)
+)
+app.config["JOB_LEASE"] = int(os.environ.get("JOB_LEASE", 300))
+app.config["JOB_POLL_INTERVAL"] = float(
+    os.environ.get("JOB_POLL_INTERVAL", 5)
+)
+app.config["LIVE_HEARTBEAT"] = float(os.environ.get("LIVE_HEARTBEAT", 15))
+app.config["LIVE_STREAM_SECONDS"] = int(
+    os.environ.get("LIVE_STREAM_SECONDS", 300)
+)
+app.config["LIVE_QUEUE_SIZE"] = int(os.environ.get("LIVE_QUEUE_SIZE", 100))
+app.config["BOARD_EVENTS_SIZE"] = int(
+    os.environ.get("BOARD_EVENTS_SIZE", 8 * 1024 * 1024)
+)
+app.config["SERVER_TIMING"] = os.environ.get("SERVER_TIMING")
+app.config["SLOW_REQUEST_MS"] = float(os.environ.get("SLOW_REQUEST_MS", 0))
+app.config["PROFILE_DIR"] = os.environ.get(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "speedleague-profiles")
+)
+app.config["PROFILE_MAX_REPORTS"] = int(
+    os.environ.get("PROFILE_MAX_REPORTS", 50)
+)
+# parse the metrics allow-list once, so a bad entry stops the app starting
+app.config["METRICS_ALLOWED_IPS"] = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.environ.get("METRICS_ALLOWED_IPS", "").split(",")
+    if network.strip()
+]
+app.config["PROXY_COUNT"] = int(os.environ.get("PROXY_COUNT", 0))
 app.secret_key = os.environ.get("SECRET_KEY")
 
-mongo = PyMongo(app)
+# take the client's address from X-Forwarded-For when behind proxies
+if app.config["PROXY_COUNT"]:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_COUNT"])
+
+# Prometheus metrics. When PROMETHEUS_MULTIPROC_DIR is set (see
+# gunicorn.conf.py) every worker writes its values to files in that directory
+# and /metrics adds them up
+REQUEST_SECONDS = Histogram(
+    "speedleague_request_duration_seconds",
+    "Time taken to handle requests, by route.",
+    ["endpoint", "method"],
+)
+REQUESTS = Counter(
+    "speedleague_requests",
+    "Requests handled, by route and status code.",
+    ["endpoint", "method", "status"],
+)
+DB_COMMAND_SECONDS = Histogram(
+    "speedleague_db_command_duration_seconds",
+    "Time taken by database commands, by collection and command.",
+    ["collection", "command"],
+)
+DB_COMMAND_FAILURES = Counter(
+    "speedleague_db_command_failures",
+    "Failed database commands, by collection and command.",
+    ["collection", "command"],
+)
+DB_CONNECTIONS = Gauge(
+    "speedleague_db_connections",
+    "Connections in the database connection pools, by state.",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+DB_CHECKOUT_FAILURES = Counter(
+    "speedleague_db_checkout_failures",
+    "Failed connection pool checkouts, by reason.",
+    ["reason"],
+)
+DB_POOL_CLEARS = Counter(
+    "speedleague_db_pool_clears",
+    "Times a connection pool was cleared after a server error.",
+)
+TEMPLATE_RENDER_SECONDS = Histogram(
+    "speedleague_template_render_duration_seconds",
+    "Time taken to render templates, by template.",
+    ["template"],
+)
+CACHE_LOOKUPS = Counter(
+    "speedleague_cache_lookups",
+    "In-process cache lookups, by cache and result.",
+    ["cache", "result"],
+)
+LIVE_STREAMS = Gauge(
+    "speedleague_live_streams",
+    "Open live leaderboard streams.",
+    multiprocess_mode="livesum",
+)
+
+
+def request_timing_enabled():
+    """
+    Returns True if requests should be timed, either for the Server-Timing
+    header or for the slow request log.
+    """
+    return bool(app.config["SERVER_TIMING"] or app.config["SLOW_REQUEST_MS"])
+
+
+class CommandTimer(monitoring.CommandListener):
+    """
+    Records the collection and duration of every database command in the
+    metrics and, when request timing is enabled, in the timings of the
+    request which sent it.
+    """
+
+    def __init__(self):
+        # collection of each command in flight, by connection and request id
+        self.pending = {}
+
+    def started(self, event):
+        # getMore commands name their collection in a separate field
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection")
+        self.pending[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event):
+        self.finish(event)
+
+    def failed(self, event):
+        self.finish(event, event.failure.get("errmsg"))
+
+    def finish(self, event, error=None):
+        collection = self.pending.pop(
+            (event.connection_id, event.request_id), None
+        )
+        duration = event.duration_micros / 1000
+        labels = (collection or "", event.command_name)
+        DB_COMMAND_SECONDS.labels(*labels).observe(duration / 1000)
+        if error:
+            DB_COMMAND_FAILURES.labels(*labels).inc()
+
+        commands = g.get("db_commands") if has_request_context() else None
+        if commands is None:
+            return
+        g.timings["db"] = g.timings.get("db", 0) + duration
+        command = {
+            "command": event.command_name,
+            "collection": collection,
+            "ms": round(duration, 3),
+        }
+        if error:
+            command["error"] = error
+        commands.append(command)
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """
+    Tracks the number of open and checked out database connections, failed
+    checkouts and pool clears in the metrics.
+    """
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        DB_POOL_CLEARS.inc()
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        DB_CONNECTIONS.labels("open").inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        DB_CONNECTIONS.labels("open").dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        DB_CHECKOUT_FAILURES.labels(event.reason).inc()
+
+    def connection_checked_out(self, event):
+        DB_CONNECTIONS.labels("checked_out").inc()
+
+    def connection_checked_in(self, event):
+        DB_CONNECTIONS.labels("checked_out").dec()
+
+
+mongo = PyMongo(app, event_listeners=[CommandTimer(), PoolMonitor()])
+
+
+@contextmanager
+def timed(name):
+    """
+    Adds the time taken by the enclosed block to the current request's timing
+    of the given name. Does nothing unless request timing is enabled.
+    """
+    timings = g.get("timings") if has_request_context() else None
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = (
+            timings.get(name, 0) + (time.perf_counter() - start) * 1000
+        )
+
+
+class TimedTemplate(app.jinja_env.template_class):
+    """
+    Jinja template which records how long it takes to render.
+    """
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with timed("render"):
+                return super().render(*args, **kwargs)
+        finally:
+            TEMPLATE_RENDER_SECONDS.labels(self.name).observe(
+                time.perf_counter() - start
+            )
+
+
+app.jinja_env.template_class = TimedTemplate
+
+
+@app.before_request
+def start_request_timing():
+    """
+    Starts timing the request for the metrics, and for the Server-Timing
+    header and slow request log if request timing is enabled.
+    """
+    g.request_started = time.perf_counter()
+    if request_timing_enabled():
+        g.timings = {}
+        g.db_commands = []
+
+
+@app.after_request
+def finish_request_timing(response):
+    """
+    Records the request's duration in the metrics. If request timing is
+    enabled, adds a Server-Timing header with the time spent on database
+    commands, template rendering and password hashing, and writes requests
+    slower than SLOW_REQUEST_MS to the log with every command they sent. The
+    header is only sent to the admin unless SERVER_TIMING is set to "all".
+    """
+    total = (time.perf_counter() - g.request_started) * 1000
+    # group unknown urls and methods so clients can't create new label values
+    endpoint = request.endpoint or "unmatched"
+    method = request.method if request.method in ("GET", "POST") else "other"
+    REQUEST_SECONDS.labels(endpoint, method).observe(total / 1000)
+    REQUESTS.labels(endpoint, method, response.status_code).inc()
+
+    timings = g.get("timings")
+    if timings is None:
+        return response
+    commands = g.db_commands
+
+    if app.config["SERVER_TIMING"] == "all" or (
+        app.config["SERVER_TIMING"] and session.get("user") == "admin"
+    ):
+        db_time = timings.get("db", 0)
+        metrics = [f'db;dur={db_time:.3f};desc="{len(commands)} commands"']
+        metrics += [
+            f"{name};dur={duration:.3f}"
+            for name, duration in timings.items()
+            if name != "db"
+        ]
+        metrics.append(f"total;dur={total:.3f}")
+        response.headers["Server-Timing"] = ", ".join(metrics)
+
+    threshold = app.config["SLOW_REQUEST_MS"]
+    if threshold and total >= threshold:
+        app.logger.warning(
+            json.dumps(
+                {
+                    "event": "slow_request",
+                    "method": request.method,
+                    "path": request.full_path.rstrip("?"),
+                    "endpoint": request.endpoint,
+                    "status": response.status_code,
+                    "user": session.get("user"),
+                    "ms": round(total, 3),
+                    "timings": {
+                        name: round(duration, 3)
+                        for name, duration in timings.items()
+                    },
+                    "command_count": len(commands),
+                    # keep log lines bounded on pages with many commands
+                    "commands": commands[:100],
+                }
+            )
+        )
+    return response
+
+
+@app.before_request
+def start_profiling():
+    """
+    Starts profiling the request if the admin asked for a profile with a
+    profile query parameter or an X-Profile header. Refused under gevent,
+    where cProfile would mix in every other request served by the worker.
+    """
+    if "profile" not in request.args and "X-Profile" not in request.headers:
+        return
+    if session.get("user") != "admin":
+        return
+    if gevent_patched():
+        abort(501, "Profiling needs sync or thread gunicorn workers.")
+    g.profile_started = time.perf_counter()
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+
+@app.after_request
+def finish_profiling(response):
+    """
+    Stops profiling the request and saves the report. Requests profiled with
+    the query parameter are redirected to the report, while those profiled
+    with the header get its url in an X-Profile-Report header.
+    """
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    report_id = save_profile(
+        profiler, response, time.perf_counter() - g.profile_started
+    )
+    report_url = url_for("profile_report", report_id=report_id)
+    if "profile" in request.args:
+        return redirect(report_url)
+    response.headers["X-Profile-Report"] = report_url
+    return response
+
+
+def save_profile(profiler, response, duration):
+    """
+    Saves a request's profile and a summary of the request to the profile
+    directory, then removes the oldest reports if there are more than
+    PROFILE_MAX_REPORTS. Returns the new report's id.
+    """
+    profile_dir = app.config["PROFILE_DIR"]
+    os.makedirs(profile_dir, exist_ok=True)
+    # ids start with the time so that sorting them sorts the reports by age
+    now = datetime.utcnow()
+    report_id = f"{now:%Y%m%d-%H%M%S-%f}-{uuid.uuid4().hex[:8]}"
+    profiler.dump_stats(os.path.join(profile_dir, f"{report_id}.prof"))
+    with open(os.path.join(profile_dir, f"{report_id}.json"), "w") as stream:
+        json.dump(
+            {
+                "id": report_id,
+                "time": f"{now:%Y-%m-%d %H:%M:%S} UTC",
+                "method": request.method,
+                "path": request.full_path.rstrip("?"),
+                "endpoint": request.endpoint,
+                "status": response.status_code,
+                "ms": round(duration * 1000, 3),
+            },
+            stream,
+        )
+
+    for old_id in profile_ids()[: -app.config["PROFILE_MAX_REPORTS"]]:
+        for extension in ("prof", "json"):
+            try:
+                os.remove(os.path.join(profile_dir, f"{old_id}.{extension}"))
+            except FileNotFoundError:
+                pass
+    return report_id
+
+
+def profile_ids():
+    """
+    Returns the ids of the saved profile reports, oldest first.
+    """
+    try:
+        names = os.listdir(app.config["PROFILE_DIR"])
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-5] for name in names if name.endswith(".json"))
+
+
+def profile_path(report_id, extension):
+    """
+    Returns the path of one of the given report's files, or aborts with a 404
+    if the report doesn't exist.
+    """
+    if not re.fullmatch(r"[0-9a-f-]+", report_id):
+        abort(404)
+    path = os.path.join(app.config["PROFILE_DIR"], f"{report_id}.{extension}")
+    if not os.path.exists(path):
+        abort(404)
+    return path
 
 
 def find_user(username):
@@ -41,6 +526,15 @@ def find_user(username):
     return user
 
 
+def check_password(password_hash, password):
+    """
+    Checks a password against its stored hash, recording the time taken in
+    the request timings.
+    """
+    with timed("password"):
+        return check_password_hash(password_hash, password)
+
+
 def login_required(f):
     """
     Decorator to check if a user is currently logged in and redirect to the
@@ -122,11 +616,10 @@ def centi_to_string(centi):
     Converts an integer number of centiseconds into a string in the format
     "hours:minutes:seconds:centiseconds".
     """
-    centiseconds = centi % 100
-    seconds = math.floor((centi / 100) % 60)
-    minutes = math.floor(((centi / (100 * 60)) % 60))
-    hours = math.floor(((centi / (100 * 60 * 60)) % 24))
-    return f"{hours}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+    seconds, centiseconds = divmod(centi, 100)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours % 24}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
 
 
 @app.template_global()
@@ -161,105 +654,3608 @@ def display_to_url(text):
     return text.replace(" ", "_")
 
 
+class MetadataCache:
+    """
+    Read-through cache of small, rarely changing collections (games and
+    categories). Each worker keeps its own copy and compares it
+    with a shared version document once per request, so a write made by any
+    gunicorn worker invalidates the copies held by all of the others.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self.version = None
+        self.modified = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def sync(self):
+        """
+        Clears the cache if the shared version document has changed since it
+        was last checked. Only checks once per request.
+        """
+        if has_request_context():
+            if g.get("metadata_synced"):
+                return
+            g.metadata_synced = True
+        meta = mongo.db.meta.find_one({"_id": "metadata"}) or {}
+        version = meta.get("version", 0)
+        with self._lock:
+            if version != self.version:
+                if self.version is not None:
+                    self.invalidations += 1
+                self._values = {}
+                self.version = version
+                self.modified = meta.get("modified")
+
+    def get(self, key, loader):
+        """
+        Returns the cached value for the given key, calling loader to fetch it
+        from the database if it isn't cached.
+        """
+        self.sync()
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                CACHE_LOOKUPS.labels("metadata", "hit").inc()
+                return self._values[key]
+            self.misses += 1
+            CACHE_LOOKUPS.labels("metadata", "miss").inc()
+            version = self.version
+        value = loader()
+        with self._lock:
+            # don't store the value if the cache was invalidated while loading
+            if version == self.version:
+                self._values[key] = value
+        return value
+
+    def clear(self):
+        """
+        Clears this worker's copy of the cache without changing the shared
+        version document, so other workers keep their copies.
+        """
+        with self._lock:
+            self._values = {}
+            self.version = None
+
+    def invalidate(self):
+        """
+        Clears the cache and increments the shared version document so that
+        every other worker clears its cache on its next request.
+        """
+        meta = mongo.db.meta.find_one_and_update(
+            {"_id": "metadata"},
+            {"$inc": {"version": 1}, "$currentDate": {"modified": True}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        with self._lock:
+            self._values = {}
+            self.version = meta["version"]
+            self.modified = meta["modified"]
+        if has_request_context():
+            g.metadata_synced = True
+        # every cached page includes the nav menu, so none of them are valid
+        page_cache.clear()
+
+    def stats(self):
+        """
+        Returns a dict of the cache's counters.
+        """
+        with self._lock:
+            return {
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "keys": sorted(self._values),
+            }
+
+
+metadata_cache = MetadataCache()
+
+
+class PageCache:
+    """
+    Bounded LRU cache of fully rendered leaderboard pages. Each entry is
+    stored with the ETag it was rendered for and is only reused while the
+    leaderboard still has that ETag, so pages changed by another worker are
+    never served. Entries also expire after a fixed time to live.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, etag):
+        """
+        Returns the cached page for the given key if it was rendered for the
+        given ETag and hasn't expired, otherwise None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is None
+                or entry[0] != etag
+                or entry[1] < time.monotonic()
+            ):
+                self.misses += 1
+                CACHE_LOOKUPS.labels("page", "miss").inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.labels("page", "hit").inc()
+            return entry[2]
+
+    def set(self, key, etag, page):
+        """
+        Stores a rendered page, evicting the least recently used pages if the
+        cache is full.
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (etag, time.monotonic() + self.ttl, page)
+            self.size += len(page)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def evict(self, category_id):
+        """
+        Removes every cached page of the given category's leaderboard.
+        """
+        with self._lock:
+            for key in [
+                key for key in self._entries if key[0] == ObjectId(category_id)
+            ]:
+                self._remove(key)
+
+    def clear(self):
+        """
+        Removes every cached page.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.size -= len(entry[2])
+
+    def stats(self):
+        """
+        Returns a dict of the cache's counters and memory use.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+page_cache = PageCache(
+    app.config["PAGE_CACHE_SIZE"], app.config["PAGE_CACHE_TTL"]
+)
+
+
+class RankIndex:
+    """
+    Sorted in-memory copy of the personal bests on one category's
+    leaderboard, kept as a list of (score, player_id) pairs in leaderboard
+    order, which answers rank queries with binary searches.
+    """
+
+    __slots__ = ("version", "keys", "bests", "lock")
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.keys = [(row["score"], row["player_id"]) for row in rows]
+        self.bests = {player_id: score for score, player_id in self.keys}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rank_of_time(self, score):
+        """
+        Returns the rank the given time would have on the leaderboard, which
+        is shared with any equal times already on it.
+        """
+        with self.lock:
+            return bisect_left(self.keys, (score,)) + 1
+
+    def rank_of_player(self, player_id):
+        """
+        Returns the given player's personal best and rank, or None if they
+        have no time on the leaderboard.
+        """
+        with self.lock:
+            score = self.bests.get(ObjectId(player_id))
+            if score is None:
+                return None
+            return score, bisect_left(self.keys, (score,)) + 1
+
+    def top(self, limit):
+        """
+        Returns the first limit (score, player_id) pairs of the leaderboard.
+        """
+        with self.lock:
+            return self.keys[:limit]
+
+    def set(self, player_id, score):
+        """
+        Moves the given player to their new personal best, or removes them
+        if score is None.
+        """
+        with self.lock:
+            old = self.bests.pop(player_id, None)
+            if old is not None:
+                del self.keys[bisect_left(self.keys, (old, player_id))]
+            if score is not None:
+                insort(self.keys, (score, player_id))
+                self.bests[player_id] = score
+
+
+class RankIndexCache:
+    """
+    Bounded LRU cache of the rank indexes of recently queried categories. An
+    index is loaded when a category is first queried and is reused while
+    the category's leaderboard version and the metadata version are
+    unchanged, so changes made by other workers are never missed. Changes
+    made by this worker update the index in place. The least recently used
+    indexes are evicted once they hold more than max_rows rows in total, but
+    the most recently used index is always kept, even if it has more rows
+    than that on its own.
+    """
+
+    def __init__(self, max_rows):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_rows = max_rows
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, category_id):
+        """
+        Returns the rank index of the given category, loading it from the
+        leaderboards collection if it isn't cached or is out of date.
+        """
+        category_id = ObjectId(category_id)
+        board = mongo.db.board_versions.find_one({"_id": category_id}) or {}
+        metadata_cache.sync()
+        version = (board.get("version", 0), metadata_cache.version)
+        with self._lock:
+            index = self._entries.get(category_id)
+            if index is not None and index.version == version:
+                self._entries.move_to_end(category_id)
+                self.hits += 1
+                CACHE_LOOKUPS.labels("rank", "hit").inc()
+                return index
+            self.misses += 1
+            CACHE_LOOKUPS.labels("rank", "miss").inc()
+
+        # the rows are already in leaderboard order, so need no sorting
+        index = RankIndex(
+            version,
+            mongo.db.leaderboards.find(
+                {"category_id": category_id}, {"score": 1, "player_id": 1}
+            )
+            .sort([("score", 1), ("player_id", 1)])
+            .batch_size(app.config["EXPORT_BATCH_SIZE"]),
+        )
+        with self._lock:
+            self._remove(category_id)
+            self._entries[category_id] = index
+            self.rows += len(index)
+            # keep the new index, so a leaderboard longer than max_rows isn't
+            # loaded again for every query
+            while self.rows > self.max_rows and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return index
+
+    def update(self, category_id, player_id, score, version):
+        """
+        Applies a change to one player's personal best, score or None if
+        their row was removed, to the cached index of the given category.
+        version is the leaderboard version returned by touch_board for the
+        change. An index which missed an earlier change is evicted instead.
+        """
+        category_id = ObjectId(category_id)
+        with self._lock:
+            index = self._entries.get(category_id)
+            if index is None:
+                return
+            if index.version != (version - 1, metadata_cache.version):
+                self._remove(category_id)
+                return
+            self.rows -= len(index)
+            index.set(ObjectId(player_id), score)
+            index.version = (version, metadata_cache.version)
+            self.rows += len(index)
+
+    def clear(self):
+        """
+        Removes every cached index.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.rows = 0
+
+    def _remove(self, category_id):
+        index = self._entries.pop(category_id, None)
+        if index is not None:
+            self.rows -= len(index)
+
+    def stats(self):
+        """
+        Returns a dict of the cache's counters and size.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "rows": self.rows,
+                "max_rows": self.max_rows,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+rank_indexes = RankIndexCache(app.config["RANK_INDEX_MAX_ROWS"])
+
+
+def load_games():
+    """
+    Loads all games from the database, indexed by id and by name.
+    """
+    games = list(mongo.db.games.find())
+    return {
+        "list": games,
+        "by_id": {game["_id"]: game for game in games},
+        "by_name": {game["name"]: game for game in games},
+    }
+
+
+def load_categories():
+    """
+    Loads all categories from the database, indexed by id and by game id and
+    name.
+    """
+    categories = list(mongo.db.categories.find())
+    return {
+        "by_id": {category["_id"]: category for category in categories},
+        "by_name": {
+            (category["game_id"], category["name"]): category
+            for category in categories
+        },
+    }
+
+
+def find_players(player_ids=None, names=None):
+    """
+    Returns the players with the given ids, keyed by id, or with the given
+    names, keyed by name, read with one indexed query. Players aren't kept in
+    the metadata cache, as there can be too many of them.
+    """
+    if names is not None:
+        players = mongo.db.players.find({"name": {"$in": list(set(names))}})
+        return {player["name"]: player for player in players}
+    players = mongo.db.players.find(
+        {"_id": {"$in": [ObjectId(player_id) for player_id in player_ids]}}
+    )
+    return {player["_id"]: player for player in players}
+
+
+def find_game_or_404(game_id=None, name=None):
+    """
+    Returns a copy of the game with the given id or name from the metadata
+    cache, or aborts with a 404 error if there isn't one.
+    """
+    games = metadata_cache.get("games", load_games)
+    if name is not None:
+        game = games["by_name"].get(name)
+    else:
+        game = games["by_id"].get(ObjectId(game_id))
+    if game is None:
+        abort(404)
+    return copy.deepcopy(game)
+
+
+def find_category_or_404(category_id=None, game_id=None, name=None):
+    """
+    Returns a copy of the category with the given id, or with the given game
+    id and name, from the metadata cache, or aborts with a 404 error if there
+    isn't one.
+    """
+    categories = metadata_cache.get("categories", load_categories)
+    if name is not None:
+        category = categories["by_name"].get((ObjectId(game_id), name))
+    else:
+        category = categories["by_id"].get(ObjectId(category_id))
+    if category is None:
+        abort(404)
+    return copy.deepcopy(category)
+
+
+def find_player_or_404(player_id=None, name=None):
+    """
+    Returns the player with the given id or name, or aborts with a 404 error
+    if there isn't one.
+    """
+    if name is not None:
+        player = mongo.db.players.find_one({"name": name})
+    else:
+        player = mongo.db.players.find_one({"_id": ObjectId(player_id)})
+    if player is None:
+        abort(404)
+    return player
+
+
+def all_games():
+    """
+    Returns the cached list of games.
+    """
+    return metadata_cache.get("games", load_games)["list"]
+
+
+# sorts names alphabetically, ignoring case and accents
+NAME_COLLATION = Collation(locale="en", strength=1)
+
+
+def name_sort_arg():
+    """
+    Returns the name sort direction requested in the query string, "name"
+    for A to Z or "-name" for Z to A.
+    """
+    sort = request.args.get("sort", "name")
+    return sort if sort in ("name", "-name") else "name"
+
+
+def sorted_page(collection, query, sort, page):
+    """
+    Returns the given page of the documents in a collection that match the
+    query, sorted by name using NAME_COLLATION, along with the page number
+    actually used and the number of pages. The sort is served by an index
+    with the same collation, so only the rows up to the page are read.
+    """
+    per_page = app.config["ADMIN_PAGE_SIZE"]
+    pages = max(1, math.ceil(collection.count_documents(query) / per_page))
+    page = max(1, min(page, pages))
+    direction = -1 if sort.startswith("-") else 1
+    documents = list(
+        collection.find(
+            query,
+            sort=[("name", direction), ("_id", direction)],
+            skip=(page - 1) * per_page,
+            limit=per_page,
+            collation=NAME_COLLATION,
+        )
+    )
+    return documents, page, pages
+
+
+def encode_player_cursor(player):
+    """
+    Returns a pagination cursor marking the position of the given player in
+    the player search results.
+    """
+    return f"{player['_id']}:{player['name']}"
+
+
+def search_players(prefix, limit, after=None, sort="name"):
+    """
+    Returns up to limit players whose names start with the given prefix,
+    ignoring case and accents, sorted by name with NAME_COLLATION, A to Z
+    for "name" or Z to A for "-name", and starting after the given cursor.
+    The prefix is matched with a range on the collated (name, _id) index, so
+    only the matching entries of the index are read however many players
+    there are. Aborts with a 400 error if the cursor is invalid.
+    """
+    direction = -1 if sort.startswith("-") else 1
+    query = {}
+    if prefix:
+        # U+FFFF sorts after every character in ICU collations, so the range
+        # holds every name that starts with the prefix
+        query["name"] = {"$gte": prefix, "$lt": prefix + "\uffff"}
+    if after:
+        try:
+            player_id, name = after.split(":", 1)
+            player_id = ObjectId(player_id)
+        except (ValueError, InvalidId):
+            abort(400)
+        op = "$gt" if direction > 0 else "$lt"
+        query["$or"] = [
+            {"name": {op: name}},
+            {"name": name, "_id": {op: player_id}},
+        ]
+    return list(
+        mongo.db.players.find(
+            query,
+            sort=[("name", direction), ("_id", direction)],
+            limit=limit,
+            collation=NAME_COLLATION,
+        )
+    )
+
+
 def nav_links():
+    """
+    Returns the cached dict of games and categories used to build nav links
+    """
+    return metadata_cache.get("nav_links", load_nav_links)
+
+
+def load_nav_links():
     """
     Build a dict of games and categories to use in building nav links
     """
-    # Retrieve list of games from database
-    games = list(mongo.db.games.find({}))
+    # Retrieve every game with its categories joined on in a single
+    # aggregation, projecting only the fields the nav and admin templates use.
+    # The equality join uses the categories' game_id index
+    games = mongo.db.games.aggregate(
+        [
+            {"$project": {"name": 1}},
+            {
+                "$lookup": {
+                    "from": "categories",
+                    "localField": "_id",
+                    "foreignField": "game_id",
+                    "as": "categories",
+                }
+            },
+            {
+                "$project": {
+                    "name": 1,
+                    "categories._id": 1,
+                    "categories.name": 1,
+                }
+            },
+        ]
+    )
     # Iteration done in nav.html:
     # https://realpython.com/iterate-through-dictionary-python/
     # Dict comprehension:
     # https://careerkarma.com/blog/python-convert-list-to-dictionary/
-    # Build a dictopmary with names of games as keys and array of categories as
+    # Build a dictionary with names of games as keys and array of categories as
     # values
-    game_dictionary = {
-        game["name"]: list(
-            mongo.db.categories.find({"game_id": ObjectId(game["_id"])})
-        )
-        for game in games
-    }
+    game_dictionary = {game["name"]: game["categories"] for game in games}
     return game_dictionary
 
 
-@app.route("/")
-def home():
+def leaderboard_pipeline(category_id):
     """
-    Finds the game name and category name of the default game and redirect to
-    its leaderboard page.
+    Returns the aggregation pipeline that calculates the leaderboard for the
+    given category from the raw scores. Scores are reduced to each player's
+    personal best before players are joined on, so there is one lookup per
+    player rather than one per run.
+    """
+    return [
+        {"$match": {"category_id": ObjectId(category_id)}},
+        {"$group": {"_id": "$player_id", "score": {"$min": "$score"}}},
+        {
+            "$lookup": {
+                "from": "players",
+                "localField": "_id",
+                "foreignField": "_id",
+                "as": "player",
+            }
+        },
+        {"$unwind": "$player"},
+        {
+            "$project": {
+                "_id": "$player.name",
+                "player_id": "$_id",
+                "score": 1,
+                "links": "$player.links",
+            }
+        },
+        {"$sort": {"score": 1}},
+    ]
+
+
+def aggregate_leaderboard(category_id):
+    """
+    Calculates the leaderboard for the given category from the raw scores,
+    returning each player's personal best sorted by score.
+    """
+    return list(mongo.db.scores.aggregate(leaderboard_pipeline(category_id)))
+
+
+def category_scores_pipeline(game_id, category_id):
+    """
+    Returns the aggregation pipeline that lists every score in the given
+    category, with the player joined on, sorted by score.
+    """
+    return [
+        {
+            "$match": {
+                "game_id": ObjectId(game_id),
+                "category_id": ObjectId(category_id),
+            }
+        },
+        {
+            "$lookup": {
+                "from": "players",
+                "localField": "player_id",
+                "foreignField": "_id",
+                "as": "player",
+            }
+        },
+        {"$unwind": "$player"},
+        {"$sort": {"score": 1}},
+    ]
+
+
+def rebuild_leaderboard(category):
+    """
+    Regenerates the materialized leaderboard rows for the given category from
+    the scores collection.
+    """
+    rows = [
+        {
+            "category_id": category["_id"],
+            "game_id": category["game_id"],
+            "player_id": score["player_id"],
+            "name": score["_id"],
+            "links": score["links"],
+            "score": score["score"],
+        }
+        for score in aggregate_leaderboard(category["_id"])
+    ]
+    mongo.db.leaderboards.delete_many({"category_id": category["_id"]})
+    if rows:
+        mongo.db.leaderboards.insert_many(rows)
+    return len(rows)
+
+
+def leaderboard_score_updates(score, player):
+    """
+    Returns the write operations that update the player's leaderboard row for
+    the score's category if the given score is a new personal best, creating
+    the row if the player doesn't have one yet. The operations must be run in
+    order.
+    """
+    row_filter = {
+        "category_id": score["category_id"],
+        "player_id": score["player_id"],
+    }
+    row = {
+        "game_id": score["game_id"],
+        "name": player["name"],
+        "links": player["links"],
+        "score": score["score"],
+    }
+    return [
+        # replace the player's row only if the new score is faster
+        UpdateOne(
+            {**row_filter, "score": {"$gt": score["score"]}}, {"$set": row}
+        ),
+        # insert a row if the player doesn't have one in this category yet
+        UpdateOne(row_filter, {"$setOnInsert": row}, upsert=True),
+    ]
+
+
+def add_leaderboard_score(score):
+    """
+    Updates the player's leaderboard row for the score's category if the given
+    score is a new personal best.
+    """
+    player = find_player_or_404(score["player_id"])
+    mongo.db.leaderboards.bulk_write(leaderboard_score_updates(score, player))
+
+
+def refresh_leaderboard_entry(category_id, player_id):
+    """
+    Recalculates the given player's personal best in the given category from
+    the scores collection and updates or removes their leaderboard row.
+    Returns the new personal best, or None if the row was removed.
     """
-    default_game = mongo.db.games.find_one_or_404(
-        {"_id": ObjectId("62ed293931cff58ed6a6148b")}
+    row_filter = {
+        "category_id": ObjectId(category_id),
+        "player_id": ObjectId(player_id),
+    }
+    best = mongo.db.scores.find_one(row_filter, sort=[("score", 1)])
+    if best is None:
+        mongo.db.leaderboards.delete_one(row_filter)
+        return None
+    player = find_player_or_404(player_id)
+    mongo.db.leaderboards.update_one(
+        row_filter,
+        {
+            "$set": {
+                "game_id": best["game_id"],
+                "name": player["name"],
+                "links": player["links"],
+                "score": best["score"],
+            }
+        },
+        upsert=True,
+    )
+    return best["score"]
+
+
+# The collections holding runs: every player's personal bests are always in
+# scores, and in compaction mode their superseded runs are in score_history
+SCORE_COLLECTIONS = ("scores", "score_history")
+
+
+def move_runs(runs, source, target):
+    """
+    Moves the given run documents from the source collection to the target
+    collection. Runs are copied before they are deleted, and replaced rather
+    than inserted, so an interrupted move can safely be repeated.
+    """
+    if not runs:
+        return 0
+    mongo.db[target].bulk_write(
+        [ReplaceOne({"_id": run["_id"]}, run, upsert=True) for run in runs],
+        ordered=False,
     )
-    default_category = mongo.db.categories.find_one_or_404(
-        {"_id": ObjectId("62ed29e68465a6e232e28242")}
+    mongo.db[source].delete_many(
+        {"_id": {"$in": [run["_id"] for run in runs]}}
     )
-    return redirect(
-        url_for(
-            "show_scores",
-            game_name=default_game["name"],
-            category_name=default_category["name"],
+    return len(runs)
+
+
+def compact_runs(category_id, player_id):
+    """
+    Moves every run of the given player in the given category except their
+    personal best from the scores collection to score_history. Returns the
+    number of runs moved.
+    """
+    runs = list(
+        mongo.db.scores.find(
+            {
+                "category_id": ObjectId(category_id),
+                "player_id": ObjectId(player_id),
+            },
+            sort=[("score", 1)],
         )
     )
+    return move_runs(runs[1:], "scores", "score_history")
 
 
-@app.route("/<game_name>/<category_name>")
-def show_scores(game_name, category_name):
+def promote_best_run(category_id, player_id):
     """
-    Renders the leaderboard page for the given game and category.
+    Moves the given player's best run in the given category from
+    score_history back to the scores collection if it is faster than their
+    best run remaining there. Called after a run is deleted from the scores
+    collection, so it always holds each player's personal best.
     """
-    # find game
-    game = mongo.db.games.find_one_or_404(
-        {"name": urllib.parse.unquote(game_name)}
+    run_filter = {
+        "category_id": ObjectId(category_id),
+        "player_id": ObjectId(player_id),
+    }
+    best = mongo.db.score_history.find_one(run_filter, sort=[("score", 1)])
+    if best is None:
+        return
+    current = mongo.db.scores.find_one(run_filter, sort=[("score", 1)])
+    if current is None or best["score"] < current["score"]:
+        move_runs([best], "score_history", "scores")
+
+
+def compact_scores():
+    """
+    Moves every superseded run from the scores collection to score_history,
+    leaving one run per player and category. Can safely be run again if
+    interrupted. Returns the number of runs moved.
+    """
+    pairs = mongo.db.scores.aggregate(
+        [
+            {
+                "$group": {
+                    "_id": {
+                        "category_id": "$category_id",
+                        "player_id": "$player_id",
+                    },
+                    "runs": {"$sum": 1},
+                }
+            },
+            {"$match": {"runs": {"$gt": 1}}},
+        ],
+        allowDiskUse=True,
     )
-    # find category
-    category = mongo.db.categories.find_one_or_404(
-        {
-            "name": urllib.parse.unquote(category_name),
-            "game_id": ObjectId(game["_id"]),
+    moved = 0
+    for pair in pairs:
+        moved += compact_runs(**pair["_id"])
+    return moved
+
+
+@app.cli.command("compact-scores")
+def compact_scores_command():
+    """
+    Moves superseded runs from the scores collection to score_history.
+    """
+    click.echo(f"Moved {compact_scores()} runs to the history.")
+
+
+def summarize_runs(runs):
+    """
+    Returns the summary entries of a player's runs, which must be given in
+    the order they were submitted, keyed by category id. Each entry holds the
+    number of runs, the personal best and the progression of personal bests,
+    each with the time it was set taken from its ObjectId.
+    """
+    entries = {}
+    for run in runs:
+        entry = entries.setdefault(
+            str(run["category_id"]),
+            {
+                "category_id": run["category_id"],
+                "game_id": run["game_id"],
+                "runs": 0,
+                "best": None,
+                "progression": [],
+            },
+        )
+        entry["runs"] += 1
+        if entry["best"] is None or run["score"] < entry["best"]:
+            entry["best"] = run["score"]
+            entry["progression"].append(
+                {"score": run["score"], "set": run["_id"].generation_time}
+            )
+    return entries
+
+
+def rebuild_player_summary(player_id, category_ids=None):
+    """
+    Recalculates the given player's summary from their runs, or only its
+    entries for the given categories. A player without a summary is given a
+    whole one rather than only those entries.
+    """
+    player_id = ObjectId(player_id)
+    run_filter = {"player_id": player_id}
+    if category_ids is not None:
+        category_ids = [ObjectId(category_id) for category_id in category_ids]
+        run_filter["category_id"] = {"$in": category_ids}
+    entries = summarize_runs(
+        heapq.merge(
+            *[
+                mongo.db[runs]
+                .find(run_filter, {"category_id": 1, "game_id": 1, "score": 1})
+                .sort("_id", 1)
+                for runs in SCORE_COLLECTIONS
+            ],
+            key=lambda run: run["_id"],
+        )
+    )
+    if category_ids is None:
+        mongo.db.player_summaries.replace_one(
+            {"_id": player_id}, {"categories": entries}, upsert=True
+        )
+        return
+    update = {}
+    if entries:
+        update["$set"] = {
+            f"categories.{key}": entry for key, entry in entries.items()
+        }
+    removed = [
+        category_id
+        for category_id in category_ids
+        if str(category_id) not in entries
+    ]
+    if removed:
+        update["$unset"] = {
+            f"categories.{category_id}": "" for category_id in removed
+        }
+    if not update:
+        return
+    result = mongo.db.player_summaries.update_one({"_id": player_id}, update)
+    if not result.matched_count:
+        rebuild_player_summary(player_id)
+
+
+def record_player_run(score, best):
+    """
+    Adds a new run to its player's summary without reading their other runs.
+    best is the player's personal best in the run's category before the run
+    was added, or None if they had no runs in it. A player without a summary
+    is given a whole one, read from all of their runs.
+    """
+    key = f"categories.{score['category_id']}"
+    update = {
+        "$set": {
+            f"{key}.category_id": score["category_id"],
+            f"{key}.game_id": score["game_id"],
+        },
+        "$inc": {f"{key}.runs": 1},
+    }
+    if best is None or score["score"] < best:
+        update["$set"][f"{key}.best"] = score["score"]
+        update["$push"] = {
+            f"{key}.progression": {
+                "score": score["score"],
+                "set": score["_id"].generation_time,
+            }
+        }
+    result = mongo.db.player_summaries.update_one(
+        {"_id": score["player_id"]}, update
+    )
+    if not result.matched_count:
+        rebuild_player_summary(score["player_id"])
+
+
+def rebuild_player_summaries():
+    """
+    Recalculates the summary of every player from their runs. Returns the
+    number of players summarized.
+    """
+    count = 0
+    for player in mongo.db.players.find({}, {"_id": 1}):
+        rebuild_player_summary(player["_id"])
+        count += 1
+    return count
+
+
+@app.cli.command("rebuild-player-summaries")
+def rebuild_player_summaries_command():
+    """
+    Recalculates the player summaries shown on player pages from the runs.
+    """
+    click.echo(f"Summarized {rebuild_player_summaries()} players.")
+
+
+def player_profile(player):
+    """
+    Returns the summary entries of every category the given player has run,
+    sorted by game and category name, with the game, category and the
+    player's current rank added, and the improvement made by each step of
+    their personal best progression. The ranks on every leaderboard are
+    counted with a single aggregation, and nothing is written.
+    """
+    summary = mongo.db.player_summaries.find_one({"_id": player["_id"]})
+    games = metadata_cache.get("games", load_games)["by_id"]
+    categories = metadata_cache.get("categories", load_categories)["by_id"]
+    # leave out categories deleted since the summary was written
+    entries = [
+        entry
+        for entry in (summary or {}).get("categories", {}).values()
+        if entry["category_id"] in categories and entry.get("best") is not None
+    ]
+    # count the faster personal bests on each leaderboard, each clause of the
+    # $or using the (category_id, score) index
+    faster = {}
+    if entries:
+        faster = {
+            group["_id"]: group["count"]
+            for group in mongo.db.leaderboards.aggregate(
+                [
+                    {
+                        "$match": {
+                            "$or": [
+                                {
+                                    "category_id": entry["category_id"],
+                                    "score": {"$lt": entry["best"]},
+                                }
+                                for entry in entries
+                            ]
+                        }
+                    },
+                    {"$group": {"_id": "$category_id", "count": {"$sum": 1}}},
+                ]
+            )
+        }
+
+    for entry in entries:
+        entry["rank"] = 1 + faster.get(entry["category_id"], 0)
+        entry["category"] = categories[entry["category_id"]]
+        entry["game"] = games[entry["category"]["game_id"]]
+        entry["medal"] = MEDALS.get(entry["rank"])
+        previous = None
+        for step in entry["progression"]:
+            step["improvement"] = (
+                previous - step["score"] if previous is not None else None
+            )
+            previous = step["score"]
+
+    entries.sort(
+        key=lambda entry: (
+            entry["game"]["name"].lower(),
+            entry["category"]["name"].lower(),
+        )
+    )
+    return entries
+
+
+def touch_board(category_id):
+    """
+    Increments the version stamp of the given category's leaderboard and
+    returns the new version. Called whenever a score in the category is
+    added or deleted, so that clients and caches holding a copy of the
+    leaderboard know that it has changed.
+    """
+    board = mongo.db.board_versions.find_one_and_update(
+        {"_id": ObjectId(category_id)},
+        {"$inc": {"version": 1}, "$currentDate": {"modified": True}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return board["version"]
+
+
+def board_validators(category_id, *variant):
+    """
+    Returns an ETag and last modified time for the given category's
+    leaderboard. Both are derived from the category's version stamp and the
+    metadata version, so they change when a score in the category changes and
+    when anything shown in the nav menu changes. Any extra variant values are
+    added to the ETag.
+    """
+    board = mongo.db.board_versions.find_one({"_id": ObjectId(category_id)})
+    board = board or {}
+    metadata_cache.sync()
+    etag = "-".join(
+        str(part)
+        for part in (board.get("version", 0), metadata_cache.version, *variant)
+    )
+    modified = [
+        stamp
+        for stamp in (board.get("modified"), metadata_cache.modified)
+        if stamp
+    ]
+    return etag, max(modified) if modified else None
+
+
+def viewer_role():
+    """
+    Returns the type of the current user, which determines the links shown in
+    the nav menu.
+    """
+    user = session.get("user")
+    if user == "admin":
+        return "admin"
+    return "user" if user else "anonymous"
+
+
+def not_modified(etag, last_modified):
+    """
+    Returns an empty 304 response if the client's cached copy matches the
+    given validators, or None if the full response needs to be sent.
+    """
+    if is_resource_modified(
+        request.environ, etag=etag, last_modified=last_modified
+    ):
+        return None
+    response = app.response_class(status=304)
+    return set_validators(response, etag, last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    """
+    Adds the given ETag and last modified time to a response and tells
+    clients to revalidate their cached copy before reusing it.
+    """
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+# medal awarded for each of the top three ranks
+MEDALS = {1: "gold", 2: "silver", 3: "bronze"}
+
+
+class LeaderboardRow:
+    """
+    A leaderboard row with everything needed to display it worked out in
+    advance: its rank, formatted time, the formatted difference from the
+    time of the rank above and its medal, if any. Uses slots, as a
+    leaderboard page can hold hundreds of rows.
+    """
+
+    __slots__ = (
+        "player_id",
+        "name",
+        "score",
+        "links",
+        "rank",
+        "time",
+        "delta",
+        "medal",
+    )
+
+    def __init__(self, row, rank, previous_score):
+        self.player_id = row["player_id"]
+        self.name = row["name"]
+        self.score = row["score"]
+        self.links = row.get("links") or {}
+        self.rank = rank
+        self.time = centi_to_string(self.score)
+        self.delta = (
+            "+" + centi_to_string(self.score - previous_score)
+            if previous_score is not None
+            else None
+        )
+        self.medal = MEDALS.get(rank)
+
+
+def rank_rows(rows, first_rank=1, first_position=1, previous=None):
+    """
+    Yields a LeaderboardRow for each of a run of consecutive leaderboard
+    rows, in one pass. Rows are given standard competition ranks, so equal
+    times share a rank and the following rank skips past them (1, 2, 2, 4).
+    first_rank and first_position are the rank and position of the first
+    row, which differ if it is tied with the rows before it, and previous
+    is the time of the rank above the first row, or None if it is first.
+    """
+    rank = first_rank
+    last_score = None
+    for position, row in enumerate(rows, start=first_position):
+        if last_score is not None and row["score"] != last_score:
+            rank = position
+            previous = last_score
+        last_score = row["score"]
+        yield LeaderboardRow(row, rank, previous)
+
+
+def encode_cursor(row):
+    """
+    Returns a pagination cursor marking the position of the given leaderboard
+    row.
+    """
+    return f"{row['score']}-{row['player_id']}"
+
+
+def decode_cursor(cursor):
+    """
+    Returns the score and player id encoded in a pagination cursor, or aborts
+    with a 400 error if the cursor is invalid.
+    """
+    try:
+        score, player_id = cursor.split("-")
+        return int(score), ObjectId(player_id)
+    except (ValueError, InvalidId):
+        abort(400)
+
+
+def keyset_filter(score, player_id, direction):
+    """
+    Returns a filter matching the leaderboard rows that come after (direction
+    1) or before (direction -1) the given score and player id in leaderboard
+    order.
+    """
+    op = "$gt" if direction > 0 else "$lt"
+    return {
+        "$or": [
+            {"score": {op: score}},
+            {"score": score, "player_id": {op: player_id}},
+        ]
+    }
+
+
+def read_leaderboard_rows(category_id, position=None, direction=1, limit=1):
+    """
+    Reads up to limit leaderboard rows for the given category, starting after
+    the given (score, player_id) position and moving in the given direction.
+    Rows are always returned in leaderboard order.
+    """
+    # a limit of 0 would mean no limit, so read nothing instead
+    if limit <= 0:
+        return []
+    query = {"category_id": ObjectId(category_id)}
+    if position:
+        query.update(keyset_filter(*position, direction))
+    rows = list(
+        mongo.db.leaderboards.find(
+            query,
+            {"name": 1, "score": 1, "links": 1, "player_id": 1},
+        )
+        .sort([("score", direction), ("player_id", direction)])
+        .limit(limit)
+    )
+    if direction < 0:
+        rows.reverse()
+    return rows
+
+
+def leaderboard_page(
+    category_id, per_page, after=None, before=None, around=None, as_of=None
+):
+    """
+    Returns a page of the given category's leaderboard using keyset
+    pagination on (score, player_id). The page starts after the after cursor,
+    ends before the before cursor or is centred on the row of the player
+    named around, and starts at the top of the leaderboard otherwise. The
+    rows are LeaderboardRow objects, ranked and compared with the rank above
+    them across page boundaries. The page also gives the position and rank
+    of its first row, the time of the rank above it and the time of the row
+    after it, if there are any. Returns None if around names a player
+    without a score. If as_of is given, the page is of the leaderboard as it
+    was at that time instead.
+    """
+    if as_of is not None:
+        return historical_page(
+            category_id, as_of, per_page, after, before, around
+        )
+    if around is not None:
+        player = mongo.db.players.find_one({"name": around}, {"_id": 1})
+        row = player and mongo.db.leaderboards.find_one(
+            {"category_id": ObjectId(category_id), "player_id": player["_id"]}
+        )
+        if not row:
+            return None
+        position = (row["score"], row["player_id"])
+        rows = []
+        # rows before the player's, leaving room for the player's own row
+        if per_page // 2 > 0:
+            rows = read_leaderboard_rows(
+                category_id, position, -1, per_page // 2
+            )
+        rows.append(row)
+        if per_page - len(rows) > 0:
+            rows += read_leaderboard_rows(
+                category_id, position, 1, per_page - len(rows)
+            )
+    elif before:
+        rows = read_leaderboard_rows(
+            category_id, decode_cursor(before), -1, per_page
+        )
+    else:
+        # read one extra row to find out whether there is a next page
+        rows = read_leaderboard_rows(
+            category_id, after and decode_cursor(after), 1, per_page + 1
+        )
+
+    page = {
+        "rows": [],
+        "prev_cursor": None,
+        "next_cursor": None,
+        "first_position": 1,
+        "first_rank": 1,
+        "previous_score": None,
+        "next_score": None,
+    }
+    if not rows:
+        return page
+
+    if around is None and not before:
+        following = rows[per_page:]
+        rows = rows[:per_page]
+    else:
+        following = read_leaderboard_rows(
+            category_id, (rows[-1]["score"], rows[-1]["player_id"]), 1, 1
+        )
+
+    # a page which starts at the top of the leaderboard needs no counting,
+    # otherwise find the first row's position by counting the rows before it
+    first = rows[0]
+    first_position = first_rank = 1
+    previous_score = None
+    if around is not None or before or after:
+        first_position += mongo.db.leaderboards.count_documents(
+            {
+                "category_id": ObjectId(category_id),
+                **keyset_filter(first["score"], first["player_id"], -1),
+            }
+        )
+    if first_position > 1:
+        previous = read_leaderboard_rows(
+            category_id, (first["score"], first["player_id"]), -1, 1
+        )
+        first_rank = first_position
+        previous_score = previous[0]["score"] if previous else None
+        # a page starting partway through a tie shares the rank of the tied
+        # rows before it, and is compared with the rank above them
+        if previous_score == first["score"]:
+            faster = {
+                "category_id": ObjectId(category_id),
+                "score": {"$lt": first["score"]},
+            }
+            first_rank = 1 + mongo.db.leaderboards.count_documents(faster)
+            above = mongo.db.leaderboards.find_one(
+                faster, {"score": 1}, sort=[("score", -1), ("player_id", -1)]
+            )
+            previous_score = above["score"] if above else None
+        page["prev_cursor"] = encode_cursor(first)
+    if following:
+        page["next_cursor"] = encode_cursor(rows[-1])
+        page["next_score"] = following[0]["score"]
+
+    page["rows"] = list(
+        rank_rows(rows, first_rank, first_position, previous_score)
+    )
+    page["first_position"] = first_position
+    page["first_rank"] = first_rank
+    page["previous_score"] = previous_score
+    return page
+
+
+def board_runs(category_id, since=None, until=None):
+    """
+    Yields the runs of the given category submitted from since until just
+    before until, from both the scores and score_history collections, in
+    the order they were submitted. The times are compared with the
+    timestamps in the runs' ObjectIds, so no date field is needed.
+    """
+    run_filter = {"category_id": ObjectId(category_id)}
+    if since or until:
+        run_filter["_id"] = {}
+    if since:
+        run_filter["_id"]["$gte"] = ObjectId.from_datetime(since)
+    if until:
+        run_filter["_id"]["$lt"] = ObjectId.from_datetime(until)
+    yield from heapq.merge(
+        *[
+            mongo.db[runs]
+            .find(run_filter, {"player_id": 1, "score": 1})
+            .sort("_id", 1)
+            .batch_size(app.config["EXPORT_BATCH_SIZE"])
+            for runs in SCORE_COLLECTIONS
+        ],
+        key=lambda run: run["_id"],
+    )
+
+
+def historical_rows(category_id, as_of):
+    """
+    Returns the rows of the given category's leaderboard as it was at the
+    given time, in leaderboard order. Starts from the latest daily snapshot
+    taken before that time and adds the runs submitted between the snapshot
+    and that time, so only part of a day's runs are read. Players who have
+    since been deleted are left out.
+    """
+    snapshot = mongo.db.board_snapshots.find_one(
+        {"category_id": ObjectId(category_id), "until": {"$lte": as_of}},
+        sort=[("until", -1)],
+    )
+    bests = dict(snapshot["rows"]) if snapshot else {}
+    since = snapshot["until"] if snapshot else None
+    for run in board_runs(category_id, since, as_of):
+        best = bests.get(run["player_id"])
+        if best is None or run["score"] < best:
+            bests[run["player_id"]] = run["score"]
+
+    players = find_players(player_ids=list(bests))
+    return [
+        {
+            "player_id": player_id,
+            "name": players[player_id]["name"],
+            "links": players[player_id]["links"],
+            "score": score,
         }
+        for score, player_id in sorted(
+            (score, player_id)
+            for player_id, score in bests.items()
+            if player_id in players
+        )
+    ]
+
+
+def historical_page(
+    category_id, as_of, per_page, after=None, before=None, around=None
+):
+    """
+    Returns a page of the given category's leaderboard as it was at the
+    given time, in the same form and with the same pagination as
+    leaderboard_page. The historical leaderboard is calculated in memory,
+    so the page is cut from it with binary searches on the cursors.
+    """
+    rows = historical_rows(category_id, as_of)
+    keys = [(row["score"], row["player_id"]) for row in rows]
+    if around is not None:
+        player = mongo.db.players.find_one({"name": around}, {"_id": 1})
+        index = next(
+            (
+                index
+                for index, row in enumerate(rows)
+                if player and row["player_id"] == player["_id"]
+            ),
+            None,
+        )
+        if index is None:
+            return None
+        start = max(0, index - per_page // 2)
+        end = start + per_page
+    elif before:
+        end = bisect_left(keys, decode_cursor(before))
+        start = max(0, end - per_page)
+    else:
+        start = bisect_right(keys, decode_cursor(after)) if after else 0
+        end = start + per_page
+
+    page = {
+        "rows": [],
+        "prev_cursor": None,
+        "next_cursor": None,
+        "first_position": 1,
+        "first_rank": 1,
+        "previous_score": None,
+        "next_score": None,
+    }
+    if start >= min(end, len(rows)):
+        return page
+
+    # rows tied with the first row share its rank, which is the position of
+    # the first of them
+    first = rows[start]
+    first_rank = bisect_left(keys, (first["score"],)) + 1
+    previous_score = keys[first_rank - 2][0] if first_rank > 1 else None
+    if start > 0:
+        page["prev_cursor"] = encode_cursor(first)
+    if end < len(rows):
+        page["next_cursor"] = encode_cursor(rows[end - 1])
+        page["next_score"] = rows[end]["score"]
+    page["rows"] = list(
+        rank_rows(rows[start:end], first_rank, start + 1, previous_score)
+    )
+    page["first_position"] = start + 1
+    page["first_rank"] = first_rank
+    page["previous_score"] = previous_score
+    return page
+
+
+def as_of_arg():
+    """
+    Returns the time requested with the as_of parameter as a naive UTC
+    datetime, or None if there isn't one. A date on its own means the end of
+    that day. Aborts with a 400 error if the time is invalid.
+    """
+    as_of = request.args.get("as_of")
+    if not as_of:
+        return None
+    try:
+        moment = datetime.fromisoformat(as_of)
+    except ValueError:
+        abort(400)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    if len(as_of) == 10:
+        moment += timedelta(days=1)
+    return moment
+
+
+def day_start(moment):
+    """
+    Returns midnight at the start of the day of the given naive UTC datetime.
+    """
+    return datetime(moment.year, moment.month, moment.day)
+
+
+def drop_board_snapshots(run):
+    """
+    Deletes the snapshots of the given run's category taken after the run was
+    submitted, as they still include it. The next snapshot job takes them
+    again from the latest snapshot left.
+    """
+    mongo.db.board_snapshots.delete_many(
+        {
+            "category_id": run["category_id"],
+            "until": {"$gt": run["_id"].generation_time.replace(tzinfo=None)},
+        }
+    )
+
+
+def snapshot_board(category, until):
+    """
+    Adds snapshots of the given category's standings at the end of each day
+    since its latest snapshot, up to the given midnight, on which runs were
+    submitted. Each snapshot builds on the one before it, so only the runs
+    submitted since the latest snapshot are read. Returns the number of
+    snapshots added.
+    """
+    latest = mongo.db.board_snapshots.find_one(
+        {"category_id": category["_id"]}, sort=[("until", -1)]
+    )
+    bests = dict(latest["rows"]) if latest else {}
+    since = latest["until"] if latest else None
+    if since and since >= until:
+        return 0
+
+    def save(day_end):
+        # store the standings as [player_id, score] pairs in rank order
+        rows = sorted(bests.items(), key=lambda row: (row[1], row[0]))
+        mongo.db.board_snapshots.replace_one(
+            {"category_id": category["_id"], "until": day_end},
+            {
+                "category_id": category["_id"],
+                "game_id": category["game_id"],
+                "until": day_end,
+                "rows": [list(row) for row in rows],
+            },
+            upsert=True,
+        )
+
+    added = 0
+    day_end = None
+    for run in board_runs(category["_id"], since, until):
+        run_day_end = day_start(
+            run["_id"].generation_time.replace(tzinfo=None)
+        ) + timedelta(days=1)
+        if day_end is not None and run_day_end != day_end:
+            save(day_end)
+            added += 1
+        day_end = run_day_end
+        best = bests.get(run["player_id"])
+        if best is None or run["score"] < best:
+            bests[run["player_id"]] = run["score"]
+    if day_end is not None:
+        save(day_end)
+        added += 1
+    return added
+
+
+def snapshot_boards(progress=None):
+    """
+    Brings the daily snapshots of every category up to the start of today.
+    Calls progress with the number of categories done and the total after
+    each category, if given. Returns the number of snapshots added.
+    """
+    until = day_start(datetime.utcnow())
+    categories = list(mongo.db.categories.find({}, {"game_id": 1}))
+    added = 0
+    for done, category in enumerate(categories, start=1):
+        added += snapshot_board(category, until)
+        if progress:
+            progress(done, len(categories), "categories snapshotted")
+    return added
+
+
+@app.cli.command("snapshot-boards")
+def snapshot_boards_command():
+    """
+    Adds daily snapshots of every category's standings up to today.
+    """
+    click.echo(f"Added {snapshot_boards()} snapshots.")
+
+
+def page_size_arg():
+    """
+    Returns the leaderboard page size requested in the query string, limited
+    to the configured maximum.
+    """
+    per_page = request.args.get(
+        "per_page", app.config["LEADERBOARD_PAGE_SIZE"], type=int
+    )
+    return max(1, min(per_page, app.config["LEADERBOARD_MAX_PAGE_SIZE"]))
+
+
+def read_score_records(stream, file_format):
+    """
+    Yields a (line number, record) pair for each record in a CSV or NDJSON
+    byte stream, reading one line at a time. Records are dicts, or the error
+    for records that aren't valid UTF-8 or can't be parsed, so that they are
+    reported without stopping the import.
+    """
+    # bytes that aren't valid UTF-8 are replaced, and their records rejected.
+    # utf-8-sig drops the byte order mark Excel writes at the start of files
+    text = io.TextIOWrapper(
+        stream, encoding="utf-8-sig", errors="replace", newline=""
+    )
+    invalid = ValueError("not valid UTF-8")
+    if file_format == "csv":
+        reader = csv.DictReader(text)
+        while True:
+            try:
+                record = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as error:
+                # the line count isn't advanced past a line that fails
+                yield reader.line_num + 1, error
+                continue
+            # the values of extra fields are gathered in a list
+            values = [str(value) for value in record.values()]
+            if any("\ufffd" in value for value in values):
+                record = invalid
+            yield reader.line_num, record
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        if "\ufffd" in line:
+            yield line_number, invalid
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as error:
+            yield line_number, error
+
+
+def score_from_record(record, games, categories, players):
+    """
+    Builds a score document from an imported (game, category, player, time)
+    record, resolving names to ids with the given lookups. Raises ValueError
+    if the record is invalid.
+    """
+    if isinstance(record, Exception):
+        raise ValueError(f"Invalid record: {record}")
+    if not isinstance(record, dict):
+        raise ValueError("Record must be an object.")
+    missing = [
+        field
+        for field in ("game", "category", "player", "time")
+        if not record.get(field)
+    ]
+    if missing:
+        raise ValueError(f"Missing {', '.join(missing)}.")
+
+    game = games["by_name"].get(display_to_url(str(record["game"])))
+    if game is None:
+        raise ValueError(f"Unknown game '{record['game']}'.")
+    category = categories["by_name"].get(
+        (game["_id"], display_to_url(str(record["category"])))
+    )
+    if category is None:
+        raise ValueError(f"Unknown category '{record['category']}'.")
+    player = players.get(str(record["player"]))
+    if player is None:
+        raise ValueError(f"Unknown player '{record['player']}'.")
+    try:
+        score = string_to_centi(str(record["time"]))
+    except (ValueError, IndexError):
+        raise ValueError(f"Invalid time '{record['time']}'.")
+
+    return {
+        "game_id": game["_id"],
+        "category_id": category["_id"],
+        "player_id": player["_id"],
+        "score": score,
+    }
+
+
+def import_scores(records, batch_size=1000, max_errors=100, progress=None):
+    """
+    Imports scores from an iterable of (row number, record) pairs of (game,
+    category, player, time) records, writing them to the database in
+    unordered batches. Invalid
+    records are skipped and reported without stopping the import. Only one
+    batch is held in memory at a time and at most max_errors errors are
+    kept, so memory use doesn't grow with the size of the import. Calls
+    progress with the number of records read after each batch, if given.
+    Returns a summary of the import.
+    """
+    summary = {"imported": 0, "failed": 0, "errors": []}
+    batch = []
+    read = 0
+    for read, (row_number, record) in enumerate(records, start=1):
+        batch.append((row_number, record))
+        if len(batch) >= batch_size:
+            import_score_batch(batch, summary, max_errors)
+            batch = []
+            if progress:
+                progress(read)
+    if batch:
+        import_score_batch(batch, summary, max_errors)
+    if progress:
+        progress(read)
+    return summary
+
+
+def import_score_batch(batch, summary, max_errors):
+    """
+    Resolves and inserts a batch of imported (row number, record) pairs,
+    then updates the leaderboards of the affected categories. Adds the
+    results to the given summary.
+    """
+
+    def add_error(row_number, message):
+        summary["failed"] += 1
+        if len(summary["errors"]) < max_errors:
+            summary["errors"].append((row_number, message))
+
+    # look up the metadata and the batch's players once for the whole batch
+    games = metadata_cache.get("games", load_games)
+    categories = metadata_cache.get("categories", load_categories)
+    players = find_players(
+        names=[
+            str(record["player"])
+            for _, record in batch
+            if isinstance(record, dict) and record.get("player")
+        ]
+    )
+
+    scores = []
+    row_numbers = []
+    for row_number, record in batch:
+        try:
+            scores.append(
+                score_from_record(record, games, categories, players)
+            )
+            row_numbers.append(row_number)
+        except ValueError as error:
+            add_error(row_number, str(error))
+    if not scores:
+        return
+
+    inserted = scores
+    try:
+        mongo.db.scores.insert_many(scores, ordered=False)
+    except BulkWriteError as error:
+        failed = set()
+        for write_error in error.details["writeErrors"]:
+            failed.add(write_error["index"])
+            add_error(row_numbers[write_error["index"]], write_error["errmsg"])
+        inserted = [
+            score for index, score in enumerate(scores) if index not in failed
+        ]
+    summary["imported"] += len(inserted)
+
+    # update each affected leaderboard row once with the batch's best score
+    bests = {}
+    for score in inserted:
+        key = (score["category_id"], score["player_id"])
+        if key not in bests or score["score"] < bests[key]["score"]:
+            bests[key] = score
+    changed = {}
+    for category_id, player_id in bests:
+        changed.setdefault(category_id, []).append(player_id)
+    before = {
+        category_id: leaderboard_rows(category_id, player_ids)
+        for category_id, player_ids in changed.items()
+    }
+    players_by_id = {player["_id"]: player for player in players.values()}
+    updates = []
+    for score in bests.values():
+        updates += leaderboard_score_updates(
+            score, players_by_id[score["player_id"]]
+        )
+    if updates:
+        mongo.db.leaderboards.bulk_write(updates)
+    # in compaction mode, move the runs the batch superseded to the history
+    if app.config["COMPACT_SCORES"]:
+        for category_id, player_id in bests:
+            compact_runs(category_id, player_id)
+    played = {}
+    for category_id, player_id in bests:
+        played.setdefault(player_id, []).append(category_id)
+    for player_id, category_ids in played.items():
+        rebuild_player_summary(player_id, category_ids)
+    for category_id, player_ids in changed.items():
+        touch_board(category_id)
+        page_cache.evict(category_id)
+        publish_board_changes(category_id, before[category_id], player_ids)
+
+
+@app.cli.command("import-scores")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "ndjson"]),
+    help="File format. Guessed from the file extension if not given.",
+)
+@click.option("--batch-size", default=1000, help="Scores written per batch.")
+def import_scores_command(path, file_format, batch_size):
+    """
+    Imports scores from a CSV or NDJSON file of game, category, player and
+    time records.
+    """
+    file_format = file_format or (
+        "csv" if path.lower().endswith(".csv") else "ndjson"
+    )
+    with open(path, "rb") as stream:
+        summary = import_scores(
+            read_score_records(stream, file_format), batch_size
+        )
+    for row_number, message in summary["errors"]:
+        click.echo(f"Line {row_number}: {message}")
+    click.echo(
+        f"{summary['imported']} scores imported, "
+        f"{summary['failed']} failed."
+    )
+
+
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+EXPORT_FIELDS = {
+    "leaderboard": ["rank", "player", "time", "centiseconds"],
+    "runs": ["id", "game", "category", "player", "time", "centiseconds"],
+    "archive": ["id", "kind", "name", "document"],
+}
+
+
+def export_leaderboard(category):
+    """
+    Yields the rows of the given category's leaderboard in order, with their
+    rank.
+    """
+    cursor = (
+        mongo.db.leaderboards.find(
+            {"category_id": ObjectId(category["_id"])},
+            {"name": 1, "score": 1, "player_id": 1},
+        )
+        .sort([("score", 1), ("player_id", 1)])
+        .batch_size(app.config["EXPORT_BATCH_SIZE"])
+    )
+    for row in rank_rows(cursor):
+        yield {
+            "rank": row.rank,
+            "player": row.name,
+            "time": row.time,
+            "centiseconds": row.score,
+        }
+
+
+def export_runs(game, category):
+    """
+    Yields every score in the given category, including superseded runs kept
+    in the history, in the same game, category, player and time form that
+    import_scores reads. Scores are read in index order so the database
+    never has to sort the whole category, and their players are looked up a
+    batch at a time.
+    """
+    cursors = [
+        mongo.db[runs]
+        .find(
+            {"category_id": ObjectId(category["_id"])},
+            {"player_id": 1, "score": 1},
+        )
+        .sort([("player_id", 1), ("score", 1)])
+        .batch_size(app.config["EXPORT_BATCH_SIZE"])
+        for runs in SCORE_COLLECTIONS
+    ]
+    scores = heapq.merge(
+        *cursors, key=lambda score: (score["player_id"], score["score"])
+    )
+    while True:
+        batch = list(itertools.islice(scores, app.config["EXPORT_BATCH_SIZE"]))
+        if not batch:
+            return
+        players = find_players(
+            player_ids={score["player_id"] for score in batch}
+        )
+        for score in batch:
+            player = players.get(score["player_id"])
+            yield {
+                "id": str(score["_id"]),
+                "game": url_to_display(game["name"]),
+                "category": url_to_display(category["name"]),
+                "player": player["name"] if player else "",
+                "time": centi_to_string(score["score"]),
+                "centiseconds": score["score"],
+            }
+
+
+def export_archive():
+    """
+    Yields every document in the archive collection, oldest first, with the
+    kind of document that was deleted.
+    """
+    cursor = (
+        mongo.db.archive.find()
+        .sort("_id", 1)
+        .batch_size(app.config["EXPORT_BATCH_SIZE"])
+    )
+    for document in cursor:
+        # cascade deletes record the kind, while older archived games,
+        # players and categories embed their deleted scores
+        if "archive_kind" in document:
+            kind = document["archive_kind"]
+        elif "categories" in document:
+            kind = "game"
+        elif "links" in document:
+            kind = "player"
+        elif "scores" in document:
+            kind = "category"
+        else:
+            kind = "score"
+        yield {
+            "id": str(document["_id"]),
+            "kind": kind,
+            "name": document.get("name", ""),
+            "document": document,
+        }
+
+
+def export_stream(records, fields, file_format):
+    """
+    Encodes an iterable of export records as CSV or NDJSON text, yielding one
+    chunk per batch of records so that only one batch is held in memory at a
+    time. Nested documents are written as MongoDB extended JSON.
+    """
+    batch_size = app.config["EXPORT_BATCH_SIZE"]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fields)
+    if file_format == "csv":
+        writer.writeheader()
+    for count, record in enumerate(records, start=1):
+        if file_format == "csv":
+            writer.writerow(
+                {
+                    key: json_util.dumps(value)
+                    if isinstance(value, dict)
+                    else value
+                    for key, value in record.items()
+                }
+            )
+        else:
+            buffer.write(json_util.dumps(record) + "\n")
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_response(kind, records, file_format, filename):
+    """
+    Returns a chunked response which streams the given export records as an
+    attachment in the given format. The file name is given in ASCII for
+    every browser, and also in UTF-8 as described in RFC 6266 if it has
+    other characters.
+    """
+    if file_format not in EXPORT_FORMATS:
+        abort(400)
+    response = app.response_class(
+        stream_with_context(
+            export_stream(records, EXPORT_FIELDS[kind], file_format)
+        ),
+        mimetype=EXPORT_FORMATS[file_format],
+    )
+    filename = f"{filename}.{file_format}"
+    simple = unicodedata.normalize("NFKD", filename)
+    simple = "".join(
+        char for char in simple if char.isascii() and char.isprintable()
+    )
+    names = {"filename": simple}
+    if simple != filename:
+        names["filename*"] = "UTF-8''" + urllib.parse.quote(
+            filename, safe="!#$&+^`|"
+        )
+    # werkzeug quotes and escapes the plain name
+    response.headers.set("Content-Disposition", "attachment", **names)
+    return response
+
+
+@app.cli.command("export")
+@click.argument("kind", type=click.Choice(list(EXPORT_FIELDS)))
+@click.option("--game", help="Game name, for leaderboard and runs exports.")
+@click.option(
+    "--category", help="Category name, for leaderboard and runs exports."
+)
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(list(EXPORT_FORMATS)),
+    default="csv",
+    show_default=True,
+)
+@click.option(
+    "--output", default="-", help="File to write to. Defaults to stdout."
+)
+def export_command(kind, game, category, file_format, output):
+    """
+    Exports a category's leaderboard or runs, or the archive collection, as
+    CSV or NDJSON.
+    """
+    if kind == "archive":
+        records = export_archive()
+    else:
+        if not game or not category:
+            raise click.UsageError(
+                f"--game and --category are required to export {kind}."
+            )
+        games = metadata_cache.get("games", load_games)["by_name"]
+        game = games.get(display_to_url(game))
+        category = game and metadata_cache.get(
+            "categories", load_categories
+        )["by_name"].get((game["_id"], display_to_url(category)))
+        if not category:
+            raise click.BadParameter("Unknown game or category.")
+        if kind == "leaderboard":
+            records = export_leaderboard(category)
+        else:
+            records = export_runs(game, category)
+
+    with click.open_file(output, "w", encoding="utf-8") as stream:
+        for chunk in export_stream(records, EXPORT_FIELDS[kind], file_format):
+            stream.write(chunk)
+
+
+def rebuild_leaderboards(progress=None):
+    """
+    Regenerates the materialized leaderboards of every category from the
+    scores collection. Calls progress with the number of categories done and
+    the total after each category, if given. Returns a list of each
+    category's name and number of players.
+    """
+    categories = list(mongo.db.categories.find({}, {"name": 1, "game_id": 1}))
+    counts = []
+    for done, category in enumerate(categories, start=1):
+        counts.append((category["name"], rebuild_leaderboard(category)))
+        touch_board(category["_id"])
+        if progress:
+            progress(done, len(categories), "categories rebuilt")
+    # remove any rows left behind by categories that no longer exist
+    mongo.db.leaderboards.delete_many(
+        {"category_id": {"$nin": [category["_id"] for category in categories]}}
+    )
+    publish_board_resets(category["_id"] for category in categories)
+    return counts
+
+
+@app.cli.command("rebuild-leaderboards")
+def rebuild_leaderboards_command():
+    """
+    Regenerates the materialized leaderboards of every category from the
+    scores collection.
+    """
+    for name, count in rebuild_leaderboards():
+        click.echo(f"{name}: {count} players")
+
+
+# The collection and the field of the scores and leaderboard rows which
+# belong to each kind of document that can be deleted with its scores
+CASCADES = {
+    "game": ("games", "game_id"),
+    "category": ("categories", "category_id"),
+    "player": ("players", "player_id"),
+}
+
+
+def transactions_supported():
+    """
+    Returns True if the database is a deployment which supports multi-document
+    transactions, i.e. a replica set or a sharded cluster.
+    """
+    # run a command first so that the client has discovered the deployment
+    mongo.db.command("ping")
+    return mongo.cx.topology_description.topology_type_name in (
+        "ReplicaSetWithPrimary",
+        "Sharded",
+        "LoadBalanced",
+    )
+
+
+def cascade_delete(kind, target_id, progress=None):
+    """
+    Archives and deletes a game, category or player along with all of its
+    scores and leaderboard rows, and a game's categories. Resumes the
+    unfinished operation for the same document if an earlier attempt was
+    interrupted. Returns the number of scores archived.
+    """
+    op = mongo.db.archive_ops.find_one_and_update(
+        {"state": "running", "kind": kind, "target_id": ObjectId(target_id)},
+        {"$setOnInsert": {"started": datetime.utcnow(), "archived": 0}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return run_cascade_delete(op, progress)
+
+
+def run_cascade_delete(op, progress=None):
+    """
+    Carries out a cascade delete operation. The document and each batch of
+    its scores are copied to the archive before they are deleted, with the
+    operation's id in archive_op. Every step can safely be repeated, so an
+    operation that was interrupted can be run again from the start. Each
+    batch is archived and deleted in a transaction when the deployment
+    supports them. Calls progress with the number of scores archived and the
+    total after each batch, if given. Returns the number of scores archived.
+    """
+    collection, field = CASCADES[op["kind"]]
+    target_filter = {"_id": op["target_id"]}
+    child_filter = {field: op["target_id"]}
+    use_transactions = transactions_supported()
+
+    def archive(documents, kind, session=None):
+        # replace rather than insert so documents archived by an interrupted
+        # attempt are simply written again
+        mongo.db.archive.bulk_write(
+            [
+                ReplaceOne(
+                    {"_id": document["_id"]},
+                    dict(document, archive_op=op["_id"], archive_kind=kind),
+                    upsert=True,
+                )
+                for document in documents
+            ],
+            ordered=False,
+            session=session,
+        )
+
+    def in_transaction(callback):
+        if not use_transactions:
+            return callback(None)
+        with mongo.cx.start_session() as session:
+            return session.with_transaction(callback)
+
+    # archive the document itself first and delete it last, so an interrupted
+    # delete can be retried from the admin panel
+    target = mongo.db[collection].find_one(target_filter)
+    if target:
+        archive([target], op["kind"])
+    if op["kind"] == "game":
+        categories = list(mongo.db.categories.find(child_filter))
+        if categories:
+            archive(categories, "category")
+    # remember the rows being removed, so live viewers can be told
+    rows = list(
+        mongo.db.leaderboards.find(
+            child_filter, {"category_id": 1, "player_id": 1, "score": 1}
+        )
+    )
+    mongo.db.leaderboards.delete_many(child_filter)
+    # mark the affected leaderboards as changed
+    boards = {}
+    for row in rows:
+        boards.setdefault(row["category_id"], []).append(row["player_id"])
+    for category_id in boards:
+        touch_board(category_id)
+    # remove the deleted entries from the player summaries and tell live
+    # viewers
+    if op["kind"] == "player":
+        mongo.db.player_summaries.delete_one(target_filter)
+        publish_board_events(
+            [
+                {
+                    "category_id": row["category_id"],
+                    "type": "rows",
+                    "changes": [
+                        {
+                            "player_id": str(row["player_id"]),
+                            "before": row["score"],
+                            "row": None,
+                        }
+                    ],
+                }
+                for row in rows
+            ]
+        )
+    else:
+        for category_id, player_ids in boards.items():
+            mongo.db.player_summaries.update_many(
+                {"_id": {"$in": player_ids}},
+                {"$unset": {f"categories.{category_id}": ""}},
+            )
+        publish_board_resets(boards)
+
+    batch_size = app.config["CASCADE_BATCH_SIZE"]
+    archived = op["archived"]
+    total = archived + sum(
+        mongo.db[runs].count_documents(child_filter)
+        for runs in SCORE_COLLECTIONS
+    )
+    for runs in SCORE_COLLECTIONS:
+        while True:
+            scores = list(mongo.db[runs].find(child_filter, limit=batch_size))
+            if not scores:
+                break
+
+            def archive_batch(session):
+                archive(scores, "score", session)
+                mongo.db[runs].delete_many(
+                    {"_id": {"$in": [score["_id"] for score in scores]}},
+                    session=session,
+                )
+                mongo.db.archive_ops.update_one(
+                    {"_id": op["_id"]},
+                    {"$inc": {"archived": len(scores)}},
+                    session=session,
+                )
+
+            in_transaction(archive_batch)
+            archived += len(scores)
+            if progress:
+                progress(archived, total, "scores archived")
+
+    if op["kind"] != "player":
+        mongo.db.board_snapshots.delete_many(child_filter)
+    if op["kind"] == "game":
+        mongo.db.categories.delete_many(child_filter)
+    mongo.db[collection].delete_one(target_filter)
+    mongo.db.archive_ops.update_one(
+        {"_id": op["_id"]},
+        {"$set": {"state": "done", "finished": datetime.utcnow()}},
+    )
+    metadata_cache.invalidate()
+    return archived
+
+
+@app.cli.command("resume-deletes")
+def resume_deletes_command():
+    """
+    Finishes any cascade deletes of games, categories or players which were
+    interrupted.
+    """
+    for op in mongo.db.archive_ops.find({"state": "running"}):
+        run_cascade_delete(op)
+        click.echo(f"Finished deleting {op['kind']} {op['target_id']}.")
+
+
+# Handlers of each kind of background job and the number of times to try
+# them, registered with the job_handler decorator
+JOB_HANDLERS = {}
+
+
+def job_handler(kind, max_attempts=3):
+    """
+    Decorator which registers a function as the handler of a kind of
+    background job. Handlers are called with a Job and the job's arguments,
+    and return the job's result. Handlers of jobs which are tried more than
+    once must be safe to run again after a failed attempt.
+    """
+
+    def decorator(f):
+        JOB_HANDLERS[kind] = (f, max_attempts)
+        return f
+
+    return decorator
+
+
+def enqueue_job(job_kind, title, **args):
+    """
+    Adds a job of the given kind to the jobs collection, to be called with
+    the given arguments. Wakes this worker's job runner and returns the job's
+    id.
+    """
+    now = datetime.utcnow()
+    job_id = mongo.db.jobs.insert_one(
+        {
+            "kind": job_kind,
+            "title": title,
+            "args": args,
+            "state": "queued",
+            "attempts": 0,
+            "max_attempts": JOB_HANDLERS[job_kind][1],
+            "progress": {"done": 0, "total": None, "message": ""},
+            "user": session.get("user") if has_request_context() else None,
+            "created": now,
+            "run_after": now,
+        }
+    ).inserted_id
+    job_runner.wake()
+    return job_id
+
+
+def schedule_job(job_kind, title, run_after, **args):
+    """
+    Queues a job of the given kind to run at run_after, unless one is already
+    queued. Used by recurring jobs to schedule their next run.
+    """
+    mongo.db.jobs.update_one(
+        {"kind": job_kind, "state": "queued"},
+        {
+            "$setOnInsert": {
+                "title": title,
+                "args": args,
+                "attempts": 0,
+                "max_attempts": JOB_HANDLERS[job_kind][1],
+                "progress": {"done": 0, "total": None, "message": ""},
+                "user": None,
+                "created": datetime.utcnow(),
+                "run_after": run_after,
+            }
+        },
+        upsert=True,
     )
-    # find scores of players who have scores in this category
-    scores = list(
-        mongo.db.scores.aggregate(
-            [
-                {
-                    "$match": {
-                        "game_id": ObjectId(game["_id"]),
-                        "category_id": ObjectId(category["_id"]),
-                    }
-                },
-                {
-                    "$lookup": {
-                        "from": "players",
-                        "localField": "player_id",
-                        "foreignField": "_id",
-                        "as": "player",
-                    }
+
+
+def claim_job():
+    """
+    Claims the oldest job that is due to run, or whose worker's lease has run
+    out, and returns it. Returns None if there are no jobs to run.
+    """
+    while True:
+        now = datetime.utcnow()
+        job = mongo.db.jobs.find_one_and_update(
+            {
+                "$or": [
+                    {"state": "queued", "run_after": {"$lte": now}},
+                    {"state": "running", "lease_until": {"$lt": now}},
+                ]
+            },
+            {
+                "$set": {
+                    "state": "running",
+                    "started": now,
+                    "lease_until": now
+                    + timedelta(seconds=app.config["JOB_LEASE"]),
                 },
-                {"$unwind": "$player"},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None or job["attempts"] <= job["max_attempts"]:
+            return job
+        # the job's worker stopped during its last attempt
+        finish_job(
+            job["_id"], error="The job's worker stopped before it finished."
+        )
+
+
+def finish_job(job_id, result=None, error=None, retry_after=None):
+    """
+    Records the result of a job's attempt. Failed jobs are queued to run
+    again after retry_after seconds if it is given.
+    """
+    update = {"state": "done", "result": result, "error": error}
+    if error:
+        update["state"] = "failed"
+    if retry_after is not None:
+        update["state"] = "queued"
+        update["run_after"] = datetime.utcnow() + timedelta(
+            seconds=retry_after
+        )
+    else:
+        update["finished"] = datetime.utcnow()
+    mongo.db.jobs.update_one(
+        {"_id": job_id}, {"$set": update, "$unset": {"lease_until": ""}}
+    )
+
+
+class Job:
+    """
+    A claimed job, passed to its handler to report progress.
+    """
+
+    def __init__(self, document):
+        self.id = document["_id"]
+        self.document = document
+
+    def progress(self, done, total=None, message=""):
+        """
+        Records the job's progress and renews its lease, so that other
+        workers don't take over the job while it is still running.
+        """
+        mongo.db.jobs.update_one(
+            {"_id": self.id},
+            {
+                "$set": {
+                    "progress": {
+                        "done": done,
+                        "total": total,
+                        "message": message,
+                    },
+                    "lease_until": datetime.utcnow()
+                    + timedelta(seconds=app.config["JOB_LEASE"]),
+                }
+            },
+        )
+
+
+def run_job(document):
+    """
+    Runs a claimed job's handler and records its result. Failed jobs are
+    retried with an increasing delay until they run out of attempts.
+    """
+    handler = JOB_HANDLERS[document["kind"]][0]
+    try:
+        result = handler(Job(document), **document["args"])
+    except Exception as error:
+        app.logger.exception("Job %s failed", document["_id"])
+        retry_after = None
+        if document["attempts"] < document["max_attempts"]:
+            retry_after = 30 * 2 ** (document["attempts"] - 1)
+        finish_job(
+            document["_id"],
+            error=f"{type(error).__name__}: {error}",
+            retry_after=retry_after,
+        )
+        return
+    finish_job(document["_id"], result)
+
+
+class JobRunner:
+    """
+    Runs background jobs from the jobs collection on a pool of threads in
+    this process, so that long admin operations don't hold up a request or
+    hit the gunicorn worker timeout. Jobs are claimed with an atomic update,
+    so every gunicorn worker can run a job runner against the same queue.
+    Jobs left running by a worker which stopped are retried once their lease
+    runs out.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self.threads = []
+
+    def start(self):
+        """
+        Starts the runner's JOB_WORKERS threads if they aren't running.
+        """
+        if self.threads:
+            return
+        with self._lock:
+            if self.threads:
+                return
+            for number in range(app.config["JOB_WORKERS"]):
+                thread = threading.Thread(
+                    target=self._work, name=f"job-runner-{number}", daemon=True
+                )
+                thread.start()
+                self.threads.append(thread)
+            # queue the recurring jobs if they aren't already
+            if self.threads:
+                try:
+                    schedule_board_snapshots()
+                except PyMongoError:
+                    app.logger.exception("Couldn't schedule recurring jobs")
+
+    def wake(self):
+        """
+        Makes the runner look for jobs straight away.
+        """
+        self.start()
+        self._wake.set()
+
+    def _work(self):
+        while True:
+            try:
+                with app.app_context():
+                    job = claim_job()
+                    if job:
+                        run_job(job)
+                        continue
+            except PyMongoError:
+                app.logger.exception("Couldn't claim a job")
+            self._wake.wait(app.config["JOB_POLL_INTERVAL"])
+            self._wake.clear()
+
+
+job_runner = JobRunner()
+
+
+@app.before_request
+def start_job_runner():
+    """
+    Starts this worker's job runner on its first request, so that jobs are
+    picked up even if they were queued by another worker.
+    """
+    job_runner.start()
+
+
+@job_handler("cascade-delete")
+def cascade_delete_job(job, kind, target_id):
+    """
+    Archives and deletes a game, category or player and all of its scores.
+    """
+    return {"archived": cascade_delete(kind, target_id, job.progress)}
+
+
+@job_handler("import-scores", max_attempts=1)
+def import_scores_job(job, file_id, file_format):
+    """
+    Imports scores from an uploaded file kept in GridFS, then removes the
+    file. Only tried once, as trying again would import some scores twice.
+    """
+    uploads = gridfs.GridFS(mongo.db, collection="uploads")
+    try:
+        with uploads.get(file_id) as stream:
+            summary = import_scores(
+                read_score_records(stream, file_format),
+                progress=lambda done: job.progress(done, None, "rows read"),
+            )
+    finally:
+        uploads.delete(file_id)
+    summary["errors"] = [list(error) for error in summary["errors"]]
+    return summary
+
+
+@job_handler("rebuild-leaderboards")
+def rebuild_leaderboards_job(job):
+    """
+    Regenerates every category's materialized leaderboard.
+    """
+    return {"categories": len(rebuild_leaderboards(job.progress))}
+
+
+@job_handler("snapshot-boards")
+def snapshot_boards_job(job):
+    """
+    Adds the daily leaderboard snapshots, after scheduling the next run.
+    """
+    schedule_board_snapshots()
+    return {"snapshots": snapshot_boards(job.progress)}
+
+
+def schedule_board_snapshots():
+    """
+    Queues the daily leaderboard snapshot job to run just after the next
+    midnight, unless it is already queued.
+    """
+    schedule_job(
+        "snapshot-boards",
+        "Snapshot leaderboards",
+        day_start(datetime.utcnow()) + timedelta(days=1, minutes=5),
+    )
+
+
+@app.cli.command("run-jobs")
+def run_jobs_command():
+    """
+    Runs background jobs until interrupted. Use with JOB_WORKERS=0 in the web
+    workers to run jobs in a separate process.
+    """
+    job_runner.start()
+    while True:
+        time.sleep(60)
+
+
+def live_row(row):
+    """
+    Returns the fields of a leaderboard row that are sent to live leaderboard
+    streams.
+    """
+    return {"name": row["name"], "score": row["score"], "links": row["links"]}
+
+
+def leaderboard_rows(category_id, player_ids):
+    """
+    Returns the given players' rows of the given category's leaderboard as a
+    dict keyed by player id.
+    """
+    rows = mongo.db.leaderboards.find(
+        {
+            "category_id": ObjectId(category_id),
+            "player_id": {"$in": [ObjectId(player) for player in player_ids]},
+        },
+        {"player_id": 1, "name": 1, "score": 1, "links": 1},
+    )
+    return {row["player_id"]: row for row in rows}
+
+
+def publish_board_events(events):
+    """
+    Adds leaderboard change events to the capped board_events collection,
+    from which the board broker of every worker passes them on to its live
+    leaderboard streams. Each event is a dict of the category_id and a type,
+    either "rows" with a list of changed rows or "reset" if the whole
+    leaderboard has changed, and is given a sequence number which streams
+    send as its event id. Failures are only logged, so a write that has
+    already been made isn't reported as failed.
+    """
+    if not events:
+        return
+    try:
+        board_broker.ensure_collection()
+        counter = mongo.db.meta.find_one_and_update(
+            {"_id": "board_events"},
+            {"$inc": {"seq": len(events)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        first = counter["seq"] - len(events) + 1
+        created = datetime.utcnow()
+        mongo.db.board_events.insert_many(
+            [
+                dict(event, seq=first + index, created=created)
+                for index, event in enumerate(events)
+            ]
+        )
+    except PyMongoError:
+        app.logger.exception("Couldn't publish leaderboard changes")
+
+
+def publish_board_changes(category_id, before, player_ids):
+    """
+    Publishes the changes made to the given players' rows of a category's
+    leaderboard. before is a dict of their rows read with leaderboard_rows
+    before the change. Rows that didn't change are left out. Each change
+    holds the player's score before the change, so viewers can work out
+    where the old row was, and the new row, or None if it was removed.
+    """
+    after = leaderboard_rows(category_id, player_ids)
+    changes = []
+    for player_id in set(before) | set(after):
+        old = before.get(player_id)
+        new = after.get(player_id)
+        if old and new and live_row(old) == live_row(new):
+            continue
+        changes.append(
+            {
+                "player_id": str(player_id),
+                "before": old["score"] if old else None,
+                "row": live_row(new) if new else None,
+            }
+        )
+    if changes:
+        publish_board_events(
+            [
                 {
-                    "$group": {
-                        "_id": "$player.name",
-                        "score": {"$min": "$score"},
-                        "links": {"$first": "$player.links"},
-                    }
-                },
-                {"$sort": {"score": 1}},
+                    "category_id": ObjectId(category_id),
+                    "type": "rows",
+                    "changes": changes,
+                }
+            ]
+        )
+
+
+def publish_board_resets(category_ids):
+    """
+    Tells the viewers of the given categories' leaderboards that the whole
+    leaderboard has changed.
+    """
+    publish_board_events(
+        [
+            {"category_id": ObjectId(category_id), "type": "reset"}
+            for category_id in category_ids
+        ]
+    )
+
+
+class BoardBroker:
+    """
+    Passes leaderboard change events on to the live leaderboard streams open
+    in this worker. A single thread per worker tails the capped board_events
+    collection and copies each event to the queue of every stream watching
+    its category, so each event is read from the database once per worker
+    however many viewers are connected, and events published by any worker
+    reach the viewers of all of them. Events are passed on in sequence order,
+    and every viewer is told to reload if one is missing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}
+        self.collection_ready = False
+        self.thread = None
+
+    def ensure_collection(self):
+        """
+        Creates the capped board_events collection if it doesn't exist yet.
+        It must be capped for the broker to tail it.
+        """
+        if self.collection_ready:
+            return
+        try:
+            mongo.db.create_collection(
+                "board_events",
+                capped=True,
+                size=app.config["BOARD_EVENTS_SIZE"],
+            )
+        except CollectionInvalid:
+            if not mongo.db.board_events.options().get("capped"):
+                app.logger.warning(
+                    "board_events isn't a capped collection, so live "
+                    "leaderboards can only poll it"
+                )
+        self.collection_ready = True
+
+    def start(self):
+        """
+        Starts the broker's thread if it isn't running.
+        """
+        if self.thread:
+            return
+        with self._lock:
+            if self.thread:
+                return
+            self.thread = threading.Thread(
+                target=self._tail, name="board-broker", daemon=True
+            )
+            self.thread.start()
+
+    def subscribe(self, category_id):
+        """
+        Returns a new queue which receives the events of the given category's
+        leaderboard.
+        """
+        self.start()
+        events = queue.Queue(app.config["LIVE_QUEUE_SIZE"])
+        with self._lock:
+            self._queues.setdefault(ObjectId(category_id), set()).add(events)
+        return events
+
+    def unsubscribe(self, category_id, events):
+        """
+        Stops sending events to a queue returned by subscribe.
+        """
+        with self._lock:
+            queues = self._queues.get(ObjectId(category_id), set())
+            queues.discard(events)
+            if not queues:
+                self._queues.pop(ObjectId(category_id), None)
+
+    def publish(self, event):
+        """
+        Copies an event to the queue of every stream watching its category.
+        A stream which has fallen so far behind that its queue is full has
+        its backlog replaced with a reset, telling the viewer to reload.
+        """
+        with self._lock:
+            queues = list(self._queues.get(event["category_id"], ()))
+        for events in queues:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                with events.mutex:
+                    events.queue.clear()
+                events.put_nowait(dict(event, type="reset"))
+
+    def reset_all(self, seq):
+        """
+        Replaces the backlog of every stream with a reset, telling every
+        viewer to reload.
+        """
+        with self._lock:
+            queues = [
+                events
+                for category_queues in self._queues.values()
+                for events in category_queues
             ]
+        for events in queues:
+            with events.mutex:
+                events.queue.clear()
+            events.put_nowait({"seq": seq, "type": "reset"})
+
+    def _tail(self):
+        last_seq = None
+        while True:
+            try:
+                self.ensure_collection()
+                if last_seq is None:
+                    newest = mongo.db.board_events.find_one(
+                        sort=[("seq", -1)]
+                    )
+                    last_seq = newest["seq"] if newest else 0
+                # include the last event seen, so the cursor matches a
+                # document and stays open waiting for new ones
+                cursor = mongo.db.board_events.find(
+                    {"seq": {"$gte": last_seq}},
+                    cursor_type=CursorType.TAILABLE_AWAIT,
+                )
+                while cursor.alive:
+                    for event in cursor:
+                        # events arrive in insertion order, and publishers
+                        # can insert them out of sequence order
+                        if event["seq"] <= last_seq:
+                            # already passed on, or covered by a reset
+                            continue
+                        if event["seq"] > last_seq + 1:
+                            # an earlier event is late or was never
+                            # inserted, so the changes can't be sent in order
+                            self.reset_all(event["seq"])
+                        else:
+                            self.publish(event)
+                        last_seq = event["seq"]
+            except PyMongoError:
+                app.logger.exception("Couldn't read leaderboard changes")
+            time.sleep(1)
+
+
+board_broker = BoardBroker()
+
+
+def sse_message(event):
+    """
+    Formats a leaderboard change event as a Server-Sent Event.
+    """
+    data = json.dumps({"changes": event.get("changes", [])})
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+# Indexes required by the queries the app makes, as lists of (keys, options)
+# for each collection. The unique indexes also enforce the duplicate name
+# checks made when adding and editing users, players, games and categories.
+REQUIRED_INDEXES = {
+    "users": [
+        ([("username", ASCENDING)], {"unique": True}),
+    ],
+    "games": [
+        ([("name", ASCENDING)], {"unique": True}),
+        (
+            [("name", ASCENDING), ("_id", ASCENDING)],
+            {"collation": NAME_COLLATION.document},
+        ),
+    ],
+    "categories": [
+        ([("game_id", ASCENDING), ("name", ASCENDING)], {"unique": True}),
+        (
+            [
+                ("game_id", ASCENDING),
+                ("name", ASCENDING),
+                ("_id", ASCENDING),
+            ],
+            {"collation": NAME_COLLATION.document},
+        ),
+    ],
+    "players": [
+        ([("name", ASCENDING)], {"unique": True}),
+        (
+            [("name", ASCENDING), ("_id", ASCENDING)],
+            {"collation": NAME_COLLATION.document},
+        ),
+    ],
+    "scores": [
+        (
+            [
+                ("category_id", ASCENDING),
+                ("player_id", ASCENDING),
+                ("score", ASCENDING),
+            ],
+            {},
+        ),
+        ([("game_id", ASCENDING), ("category_id", ASCENDING)], {}),
+        ([("player_id", ASCENDING)], {}),
+        ([("category_id", ASCENDING), ("_id", ASCENDING)], {}),
+    ],
+    "score_history": [
+        (
+            [
+                ("category_id", ASCENDING),
+                ("player_id", ASCENDING),
+                ("score", ASCENDING),
+            ],
+            {},
+        ),
+        ([("category_id", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("game_id", ASCENDING), ("category_id", ASCENDING)], {}),
+        ([("player_id", ASCENDING)], {}),
+    ],
+    "leaderboards": [
+        (
+            [("category_id", ASCENDING), ("player_id", ASCENDING)],
+            {"unique": True},
+        ),
+        (
+            [
+                ("category_id", ASCENDING),
+                ("score", ASCENDING),
+                ("player_id", ASCENDING),
+            ],
+            {},
+        ),
+        ([("player_id", ASCENDING)], {}),
+        ([("game_id", ASCENDING)], {}),
+    ],
+    "board_snapshots": [
+        (
+            [("category_id", ASCENDING), ("until", ASCENDING)],
+            {"unique": True},
+        ),
+        ([("game_id", ASCENDING)], {}),
+    ],
+    "archive": [
+        ([("archive_op", ASCENDING)], {}),
+    ],
+    "archive_ops": [
+        (
+            [
+                ("state", ASCENDING),
+                ("kind", ASCENDING),
+                ("target_id", ASCENDING),
+            ],
+            {},
+        ),
+    ],
+    "jobs": [
+        ([("state", ASCENDING), ("created", ASCENDING)], {}),
+        ([("created", ASCENDING)], {}),
+    ],
+    "board_events": [
+        ([("category_id", ASCENDING), ("seq", ASCENDING)], {}),
+        ([("seq", ASCENDING)], {}),
+    ],
+}
+
+# Example filters and sorts of the queries that must be served by an index,
+# as (collection, filter, sort) tuples. Used by ensure-indexes --check to
+# confirm that none of them would need a collection scan.
+INDEXED_QUERIES = [
+    ("users", {"username": ""}, None),
+    ("games", {"name": ""}, None),
+    ("categories", {"game_id": ObjectId(), "name": ""}, None),
+    ("categories", {"game_id": ObjectId()}, None),
+    ("players", {"name": ""}, None),
+    ("scores", {"category_id": ObjectId()}, None),
+    (
+        "scores",
+        {"category_id": ObjectId(), "player_id": ObjectId()},
+        [("score", ASCENDING)],
+    ),
+    ("scores", {"game_id": ObjectId(), "category_id": ObjectId()}, None),
+    ("scores", {"game_id": ObjectId()}, None),
+    ("scores", {"player_id": ObjectId()}, None),
+    ("score_history", {"category_id": ObjectId()}, None),
+    (
+        "score_history",
+        {"category_id": ObjectId(), "player_id": ObjectId()},
+        [("score", ASCENDING)],
+    ),
+    ("score_history", {"player_id": ObjectId()}, None),
+    (
+        "scores",
+        {"category_id": ObjectId(), "_id": {"$gte": ObjectId()}},
+        [("_id", ASCENDING)],
+    ),
+    (
+        "score_history",
+        {"category_id": ObjectId(), "_id": {"$gte": ObjectId()}},
+        [("_id", ASCENDING)],
+    ),
+    (
+        "board_snapshots",
+        {"category_id": ObjectId(), "until": {"$lte": datetime.utcnow()}},
+        [("until", DESCENDING)],
+    ),
+    (
+        "leaderboards",
+        {"category_id": ObjectId()},
+        [("score", ASCENDING), ("player_id", ASCENDING)],
+    ),
+    (
+        "leaderboards",
+        {"category_id": ObjectId(), "player_id": ObjectId()},
+        None,
+    ),
+    ("leaderboards", {"player_id": ObjectId()}, None),
+    ("leaderboards", {"game_id": ObjectId()}, None),
+    ("archive", {"archive_op": ObjectId()}, None),
+    (
+        "archive_ops",
+        {"state": "running", "kind": "", "target_id": ObjectId()},
+        None,
+    ),
+    ("jobs", {"state": "queued"}, [("created", ASCENDING)]),
+    ("jobs", {}, [("created", ASCENDING)]),
+    (
+        "board_events",
+        {"category_id": ObjectId(), "seq": {"$gt": 0}},
+        [("seq", ASCENDING)],
+    ),
+    ("board_events", {}, [("seq", ASCENDING)]),
+]
+
+
+def index_name(keys):
+    """
+    Returns the default name MongoDB gives an index with the given keys.
+    """
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def plan_stages(plan):
+    """
+    Yields the name of every stage in an explain() query plan.
+    """
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from plan_stages(plan[key])
+    for stage in plan.get("inputStages", []):
+        yield from plan_stages(stage)
+
+
+def index_matches(info, keys, options):
+    """
+    Returns True if an index described by index_information() has the given
+    keys and the same unique and collation options, so that an index with
+    the right name but the wrong options isn't mistaken for a required one.
+    """
+    if [tuple(key) for key in info["key"]] != [tuple(key) for key in keys]:
+        return False
+    if bool(info.get("unique")) != bool(options.get("unique")):
+        return False
+    wanted = options.get("collation") or {}
+    collation = info.get("collation") or {}
+    return bool(wanted) == bool(collation) and all(
+        collation.get(field) == value for field, value in wanted.items()
+    )
+
+
+def missing_indexes():
+    """
+    Yields the (collection, keys, options) of every required index that
+    doesn't exist with the required options.
+    """
+    for collection, indexes in REQUIRED_INDEXES.items():
+        existing = mongo.db[collection].index_information().values()
+        for keys, options in indexes:
+            if not any(
+                index_matches(info, keys, options) for info in existing
+            ):
+                yield collection, keys, options
+
+
+def ensure_indexes(check=False, report=click.echo):
+    """
+    Creates any of the required indexes that are missing, passing a message
+    about each one created to report. Each index is created on its own, so
+    one that can't be built doesn't stop the others. If check is True,
+    nothing is created and the missing indexes are reported instead, along
+    with any of the indexed queries that would need a collection scan.
+    Returns a list of problems found.
+    """
+    problems = []
+    # the capped collection must be created before indexes are added to it
+    if not check:
+        board_broker.ensure_collection()
+    for collection, keys, options in list(missing_indexes()):
+        name = options.get("name", index_name(keys))
+        if check:
+            problems.append(f"{collection}: missing index {name}")
+            continue
+        try:
+            mongo.db[collection].create_index(keys, **options)
+        except ConnectionFailure:
+            raise
+        except PyMongoError as error:
+            # e.g. duplicate names, or an index of the same name with other
+            # options, which must be fixed by hand
+            problems.append(
+                f"{collection}: couldn't create index {name}: {error}"
+            )
+            continue
+        report(f"{collection}: created index {name}")
+
+    if check:
+        for collection, query, sort in INDEXED_QUERIES:
+            cursor = mongo.db[collection].find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            plan = cursor.explain()["queryPlanner"]["winningPlan"]
+            if "COLLSCAN" in plan_stages(plan):
+                problems.append(
+                    f"{collection}: collection scan for {query} sort {sort}"
+                )
+    return problems
+
+
+@app.cli.command("ensure-indexes")
+@click.option(
+    "--check",
+    is_flag=True,
+    help="Report missing indexes and collection scans without creating any.",
+)
+def ensure_indexes_command(check):
+    """
+    Creates the indexes the app relies on, or checks that they exist.
+    """
+    problems = ensure_indexes(check=check)
+    if problems:
+        raise click.ClickException("\n".join(problems))
+    click.echo("All required indexes are present.")
+
+
+def explain_stats(explain):
+    """
+    Walks the output of an explain command, returning the total number of
+    documents examined and whether any part of the plan had to scan a whole
+    collection (including unindexed $lookup joins).
+    """
+    docs_examined = 0
+    collection_scan = False
+    stack = [explain]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, list):
+            stack.extend(value)
+            continue
+        if not isinstance(value, dict):
+            continue
+        if (
+            value.get("stage") == "COLLSCAN"
+            or value.get("collectionScans")
+            or value.get("strategy") in ("HashJoin", "NestedLoopJoin")
+        ):
+            collection_scan = True
+        docs_examined += value.get("totalDocsExamined", 0)
+        stack.extend(
+            child for key, child in value.items() if key != "rejectedPlans"
+        )
+    return docs_examined, collection_scan
+
+
+def query_plan_checks(score):
+    """
+    Returns the explain commands for the leaderboard, delete scores and
+    cascade delete queries, run against the game, category and player of the
+    given score, as (description, command, budget) tuples. The budget is the
+    most documents each query may examine.
+    """
+    category_filter = {"category_id": score["category_id"]}
+    game_filter = {"game_id": score["game_id"]}
+    player_filter = {"player_id": score["player_id"]}
+    category_runs = mongo.db.scores.count_documents(category_filter)
+    category_players = len(
+        mongo.db.scores.distinct("player_id", category_filter)
+    )
+    game_runs = mongo.db.scores.count_documents(game_filter)
+    player_runs = mongo.db.scores.count_documents(player_filter)
+    return [
+        (
+            "leaderboard aggregation",
+            {
+                "aggregate": "scores",
+                "pipeline": leaderboard_pipeline(score["category_id"]),
+                "cursor": {},
+            },
+            category_runs + category_players,
+        ),
+        (
+            "leaderboard read",
+            {
+                "find": "leaderboards",
+                "filter": category_filter,
+                "sort": {"score": 1, "player_id": 1},
+            },
+            category_players,
+        ),
+        (
+            "delete scores aggregation",
+            {
+                "aggregate": "scores",
+                "pipeline": category_scores_pipeline(
+                    score["game_id"], score["category_id"]
+                ),
+                "cursor": {},
+            },
+            category_runs * 2,
+        ),
+        (
+            "delete game scores",
+            {"delete": "scores", "deletes": [{"q": game_filter, "limit": 0}]},
+            game_runs,
+        ),
+        (
+            "delete category scores",
+            {
+                "delete": "scores",
+                "deletes": [{"q": category_filter, "limit": 0}],
+            },
+            category_runs,
+        ),
+        (
+            "delete player scores",
+            {
+                "delete": "scores",
+                "deletes": [{"q": player_filter, "limit": 0}],
+            },
+            player_runs,
+        ),
+        (
+            "delete category leaderboard",
+            {
+                "delete": "leaderboards",
+                "deletes": [{"q": category_filter, "limit": 0}],
+            },
+            category_players,
+        ),
+    ]
+
+
+@app.cli.command("check-query-plans")
+@click.option(
+    "--seed",
+    is_flag=True,
+    help="Fill an empty database with sample data before checking.",
+)
+@click.option("--games", default=3, help="Number of games to seed.")
+@click.option("--categories", default=3, help="Categories to seed per game.")
+@click.option("--players", default=2000, help="Number of players to seed.")
+@click.option("--runs", default=30, help="Mean runs to seed per player.")
+def check_query_plans_command(seed, games, categories, players, runs):
+    """
+    Runs explain() on the leaderboard, delete scores and cascade delete
+    queries and fails if any of them scans a whole collection or examines
+    more documents than its budget. Intended for CI against a local mongod.
+    """
+    if seed:
+        if mongo.db.scores.estimated_document_count():
+            raise click.ClickException(
+                "Refusing to seed a database that already contains scores."
+            )
+        # the benchmarks' generator imports this module, so import it here
+        from benchmarks.data import generate
+
+        generate(games, categories, players, runs)
+
+    score = mongo.db.scores.find_one()
+    if score is None:
+        raise click.ClickException("There are no scores to check against.")
+
+    problems = []
+    for description, command, budget in query_plan_checks(score):
+        explain = mongo.db.command(
+            "explain", command, verbosity="executionStats"
+        )
+        docs_examined, collection_scan = explain_stats(explain)
+        click.echo(
+            f"{description}: {docs_examined} docs examined, budget {budget}"
+        )
+        if collection_scan:
+            problems.append(f"{description}: scans a whole collection")
+        if docs_examined > budget:
+            problems.append(
+                f"{description}: examined {docs_examined} documents, "
+                f"budget is {budget}"
+            )
+    if problems:
+        raise click.ClickException("\n".join(problems))
+    click.echo("All query plans are within budget.")
+
+
+indexes_lock = threading.Lock()
+indexes_ready = False
+missing_unique_indexes = []
+
+
+@app.before_request
+def ensure_indexes_once():
+    """
+    Creates any missing required indexes before the first request this
+    process serves, unless ENSURE_INDEXES is 0. Tried again on the next
+    request if the database can't be reached. The unique indexes enforce the
+    duplicate name checks, so while any of them is missing, requests from
+    logged in users, who are the only ones who can write, are refused.
+    """
+    global indexes_ready
+    if not indexes_ready and app.config["ENSURE_INDEXES"]:
+        with indexes_lock:
+            if not indexes_ready:
+                try:
+                    for problem in ensure_indexes(report=app.logger.info):
+                        app.logger.error(problem)
+                    missing_unique_indexes[:] = [
+                        f"{collection}.{index_name(keys)}"
+                        for collection, keys, options in missing_indexes()
+                        if options.get("unique")
+                    ]
+                except ConnectionFailure:
+                    app.logger.exception(
+                        "Couldn't create the required indexes"
+                    )
+                    return
+                indexes_ready = True
+    if missing_unique_indexes and session.get("user"):
+        abort(
+            503,
+            "Changes are disabled until these unique indexes exist: "
+            + ", ".join(missing_unique_indexes)
+            + ". Remove the duplicates and run flask ensure-indexes.",
+        )
+
+
+@app.route("/")
+def home():
+    """
+    Finds the game name and category name of the default game and redirect to
+    its leaderboard page.
+    """
+    default_game = find_game_or_404("62ed293931cff58ed6a6148b")
+    default_category = find_category_or_404("62ed29e68465a6e232e28242")
+    return redirect(
+        url_for(
+            "show_scores",
+            game_name=default_game["name"],
+            category_name=default_category["name"],
+        )
+    )
+
+
+@app.route("/<game_name>/<category_name>")
+def show_scores(game_name, category_name):
+    """
+    Renders the leaderboard page for the given game and category.
+    """
+    # find game
+    game = find_game_or_404(name=urllib.parse.unquote(game_name))
+    # find category
+    category = find_category_or_404(
+        game_id=game["_id"], name=urllib.parse.unquote(category_name)
+    )
+    # send an empty response if the viewer's copy is still current, unless
+    # there are flashed messages waiting to be shown
+    etag, last_modified = board_validators(category["_id"], viewer_role())
+    cacheable = "_flashes" not in session
+    if cacheable:
+        response = not_modified(etag, last_modified)
+        if response:
+            return response
+
+        # reuse a page already rendered for this type of user
+        page_key = (category["_id"], viewer_role(), request.query_string)
+        cached_page = page_cache.get(page_key, etag)
+        if cached_page is not None:
+            return set_validators(
+                make_response(cached_page), etag, last_modified
+            )
+
+    # read the requested page of the category's leaderboard
+    per_page = page_size_arg()
+    around = request.args.get("around")
+    as_of = as_of_arg()
+    page = leaderboard_page(
+        category["_id"],
+        per_page,
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+        around=around,
+        as_of=as_of,
+    )
+    # if the player has no score in this category, show the first page
+    if page is None:
+        flash(f"{around} has no score in this category.")
+        cacheable = False
+        page = leaderboard_page(category["_id"], per_page, as_of=as_of)
+
+    response = make_response(
+        render_template(
+            "show_scores.html",
+            page_title=url_to_display(game["name"])
+            + " - "
+            + url_to_display(category["name"]),
+            scores=page["rows"],
+            prev_cursor=page["prev_cursor"],
+            next_cursor=page["next_cursor"],
+            first_position=page["first_position"],
+            first_rank=page["first_rank"],
+            previous_score=page["previous_score"],
+            next_score=page["next_score"],
+            per_page=per_page,
+            as_of=as_of,
+            game=game,
+            category=category,
+            nav_links=nav_links(),
         )
     )
+    # pages showing flashed messages mustn't be reused from a cache
+    if not cacheable:
+        response.cache_control.no_store = True
+        return response
+    page_cache.set(page_key, etag, response.get_data())
+    return set_validators(response, etag, last_modified)
+
+
+@app.route("/players/<player_name>")
+def player_page(player_name):
+    """
+    Renders the profile page of the given player, listing every category
+    they have run with their rank, personal best and its progression.
+    """
+    player = find_player_or_404(name=urllib.parse.unquote(player_name))
+    return render_template(
+        "player.html",
+        page_title=player["name"],
+        nav_links=nav_links(),
+        player=player,
+        entries=player_profile(player),
+    )
+
+
+@app.route("/<game_name>/<category_name>/events")
+def board_events(game_name, category_name):
+    """
+    Streams changes to the given category's leaderboard as Server-Sent
+    Events, which the leaderboard page uses to update itself. Viewers who
+    reconnect with a Last-Event-ID are sent the events they missed, or told
+    to reload if those are no longer kept. Streams end after
+    LIVE_STREAM_SECONDS and the browser reconnects, so streams to viewers who
+    have gone away don't build up.
+    """
+    # find game and category
+    game = find_game_or_404(name=urllib.parse.unquote(game_name))
+    category = find_category_or_404(
+        game_id=game["_id"], name=urllib.parse.unquote(category_name)
+    )
+    last_seq = request.headers.get("Last-Event-ID", type=int)
+    heartbeat = app.config["LIVE_HEARTBEAT"]
+
+    def stream():
+        # subscribe before looking for missed events, so none are lost
+        events = board_broker.subscribe(category["_id"])
+        LIVE_STREAMS.inc()
+        try:
+            # tell the browser how many milliseconds to wait before
+            # reconnecting
+            yield "retry: 3000\n\n"
+            replayed = set()
+            if last_seq is not None:
+                oldest = mongo.db.board_events.find_one(sort=[("seq", 1)])
+                if oldest and oldest["seq"] > last_seq + 1:
+                    yield sse_message({"seq": last_seq, "type": "reset"})
+                    return
+                for event in mongo.db.board_events.find(
+                    {"category_id": category["_id"], "seq": {"$gt": last_seq}}
+                ).sort("seq", 1):
+                    replayed.add(event["seq"])
+                    yield sse_message(event)
+
+            deadline = time.monotonic() + app.config["LIVE_STREAM_SECONDS"]
+            while time.monotonic() < deadline:
+                try:
+                    event = events.get(timeout=heartbeat)
+                except queue.Empty:
+                    # a comment stops proxies closing an idle stream, and
+                    # finds viewers who have gone away
+                    yield ": heartbeat\n\n"
+                    continue
+                if event["seq"] not in replayed:
+                    yield sse_message(event)
+        finally:
+            LIVE_STREAMS.dec()
+            board_broker.unsubscribe(category["_id"], events)
+
+    response = app.response_class(stream(), mimetype="text/event-stream")
+    response.cache_control.no_store = True
+    # stop nginx and similar proxies holding back events in a buffer
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def api_response(data, etag=None, last_modified=None):
+    """
+    Returns the given data as a JSON response with a strong ETag, or an empty
+    304 response if the client already has the same representation. The ETag
+    is a hash of the response unless one is given.
+    """
+    response = jsonify(data)
+    if etag:
+        set_validators(response, etag, last_modified)
+    else:
+        response.add_etag()
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def api_row(row):
+    """
+    Converts a leaderboard row into the compact form returned by the API.
+    """
+    return {
+        "rank": row.rank,
+        "player": row.name,
+        "centiseconds": row.score,
+        "links": {key: link for key, link in row.links.items() if link},
+    }
+
+
+@app.route("/api/games")
+def api_games():
+    """
+    Returns every game and the names of its categories as JSON.
+    """
+    links = nav_links()
+    return api_response(
+        [
+            {
+                "id": str(game["_id"]),
+                "name": game["name"],
+                "categories": [
+                    category["name"]
+                    for category in links.get(game["name"], [])
+                ],
+            }
+            for game in all_games()
+        ]
+    )
+
+
+@app.route("/api/<game_name>/categories")
+def api_categories(game_name):
+    """
+    Returns the categories of the given game as JSON.
+    """
+    game = find_game_or_404(name=urllib.parse.unquote(game_name))
+    categories = nav_links().get(game["name"], [])
+    return api_response(
+        [
+            {
+                "id": str(category["_id"]),
+                "name": category["name"],
+                "desc": find_category_or_404(category["_id"]).get("desc"),
+            }
+            for category in categories
+        ]
+    )
 
-    return render_template(
-        "show_scores.html",
-        page_title=url_to_display(game["name"])
-        + " - "
-        + url_to_display(category["name"]),
-        scores=scores,
-        game=game,
-        category=category,
-        nav_links=nav_links(),
+
+@app.route("/api/<game_name>/<category_name>/leaderboard")
+def api_leaderboard(game_name, category_name):
+    """
+    Returns a page of the given category's leaderboard as JSON. Accepts the
+    same per_page, after, before, around and as_of parameters as the
+    leaderboard page.
+    """
+    game = find_game_or_404(name=urllib.parse.unquote(game_name))
+    category = find_category_or_404(
+        game_id=game["_id"], name=urllib.parse.unquote(category_name)
+    )
+    # send an empty response if the client's copy is still current
+    etag, last_modified = board_validators(category["_id"], "api")
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
+
+    page = leaderboard_page(
+        category["_id"],
+        page_size_arg(),
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+        around=request.args.get("around"),
+        as_of=as_of_arg(),
+    )
+    if page is None:
+        abort(404)
+    return api_response(
+        {
+            "game": game["name"],
+            "category": category["name"],
+            "rows": [api_row(row) for row in page["rows"]],
+            "prev_cursor": page["prev_cursor"],
+            "next_cursor": page["next_cursor"],
+        },
+        etag,
+        last_modified,
+    )
+
+
+@app.route("/api/<game_name>/<category_name>/rank")
+def api_rank(game_name, category_name):
+    """
+    Answers rank queries about the given category's leaderboard as JSON from
+    its in-memory rank index. time (hours:minutes:seconds.centiseconds) or
+    centiseconds asks for the rank a time would have, player asks for a
+    player's rank and top asks for the first rows. Any of them can be
+    combined in one request.
+    """
+    game = find_game_or_404(name=urllib.parse.unquote(game_name))
+    category = find_category_or_404(
+        game_id=game["_id"], name=urllib.parse.unquote(category_name)
     )
+    centiseconds = request.args.get("centiseconds", type=int)
+    if "time" in request.args:
+        try:
+            centiseconds = string_to_centi(request.args["time"])
+        except (IndexError, ValueError):
+            abort(400)
+    player_name = request.args.get("player")
+    top = request.args.get("top", type=int)
+    if centiseconds is None and player_name is None and top is None:
+        abort(400)
+
+    index = rank_indexes.get(category["_id"])
+    data = {
+        "game": game["name"],
+        "category": category["name"],
+        "players": len(index),
+    }
+    if centiseconds is not None:
+        data["time"] = {
+            "time": centi_to_string(centiseconds),
+            "centiseconds": centiseconds,
+            "rank": index.rank_of_time(centiseconds),
+        }
+    if player_name is not None:
+        player = mongo.db.players.find_one({"name": player_name})
+        found = player and index.rank_of_player(player["_id"])
+        if not found:
+            abort(404)
+        data["player"] = {
+            "player": player["name"],
+            "centiseconds": found[0],
+            "rank": found[1],
+        }
+    if top is not None:
+        limit = max(1, min(top, app.config["LEADERBOARD_MAX_PAGE_SIZE"]))
+        keys = index.top(limit)
+        players = find_players(player_ids=[player_id for _, player_id in keys])
+        data["top"] = [
+            api_row(row)
+            for row in rank_rows(
+                {
+                    "player_id": player_id,
+                    "name": players[player_id]["name"],
+                    "score": score,
+                    "links": players[player_id]["links"],
+                }
+                for score, player_id in keys
+            )
+        ]
+    return jsonify(data)
 
 
 @app.route("/manage_users")
@@ -286,14 +4282,7 @@ def add_user():
     is "admin
     """
     if request.method == "POST":
-        # check if submitted username already exists in the database
         username = request.form.get("username").lower()
-        duplicate_user = find_user(username)
-
-        # if username already exists, redirect to add user page
-        if duplicate_user:
-            flash(f'Username "{username}" is unavailable.')
-            return redirect(url_for("add_user"))
 
         # build dictionary with submitted details
         new_user = {
@@ -301,8 +4290,13 @@ def add_user():
             "password": generate_password_hash(request.form.get("password")),
         }
 
-        # insert new user dict to users database
-        mongo.db.users.insert_one(new_user)
+        # insert new user dict to users database, redirecting to add user page
+        # if the username already exists
+        try:
+            mongo.db.users.insert_one(new_user)
+        except DuplicateKeyError:
+            flash(f'Username "{username}" is unavailable.')
+            return redirect(url_for("add_user"))
 
         flash(f"User '{username}' has been added to the database.")
         return redirect(url_for("add_user"))
@@ -368,7 +4362,7 @@ def login():
             if valid_username:
 
                 # check the submitted password matches the database
-                if check_password_hash(
+                if check_password(
                     valid_username["password"], request.form.get("password")
                 ):
 
@@ -418,7 +4412,7 @@ def update_password():
         user = find_user(session.get("user"))
 
         # check that the submitted current password matches the database
-        if check_password_hash(user["password"], request.form.get("password")):
+        if check_password(user["password"], request.form.get("password")):
             # update user's password and redirect to admin page
             new_password = generate_password_hash(
                 request.form.get("new_password")
@@ -447,21 +4441,97 @@ def update_password():
 @login_required
 def admin():
     """
-    Renders the admin panel page.
+    Renders the admin panel page. Its tables are loaded a page at a time
+    from the fragment routes below, so the page stays small however many
+    games, categories and players there are.
     """
-    # query the database for all stored games and players
-    games = list(mongo.db.games.find())
-    players = list(mongo.db.players.find())
-
-    # sort players list by name
-    players.sort(key=lambda x: x["name"].lower())
-
     return render_template(
         "admin.html",
         page_title="Admin Panel",
         nav_links=nav_links(),
+    )
+
+
+# the sections of the admin panel which list games or categories
+ADMIN_VIEWS = ("scores", "games", "categories")
+
+
+@app.route("/admin/games")
+@login_required
+def admin_games():
+    """
+    Renders a page of the games table for the section of the admin panel
+    given by the view parameter.
+    """
+    view = request.args.get("view", "games")
+    if view not in ADMIN_VIEWS:
+        abort(400)
+    sort = name_sort_arg()
+    games, page, pages = sorted_page(
+        mongo.db.games, {}, sort, request.args.get("page", 1, type=int)
+    )
+    return render_template(
+        "includes/admin_games.html",
         games=games,
+        view=view,
+        sort=sort,
+        page=page,
+        pages=pages,
+    )
+
+
+@app.route("/admin/games/<game_id>/categories")
+@login_required
+def admin_categories(game_id):
+    """
+    Renders a page of the given game's categories table for the section of
+    the admin panel given by the view parameter.
+    """
+    view = request.args.get("view", "categories")
+    if view not in ADMIN_VIEWS:
+        abort(400)
+    game = find_game_or_404(game_id)
+    sort = name_sort_arg()
+    categories, page, pages = sorted_page(
+        mongo.db.categories,
+        {"game_id": game["_id"]},
+        sort,
+        request.args.get("page", 1, type=int),
+    )
+    return render_template(
+        "includes/admin_categories.html",
+        game=game,
+        categories=categories,
+        view=view,
+        sort=sort,
+        page=page,
+        pages=pages,
+    )
+
+
+@app.route("/admin/players")
+@login_required
+def admin_players():
+    """
+    Renders a page of the players table, filtered to the players whose names
+    start with the q parameter and sorted by the sort parameter. Later pages
+    start after the after cursor.
+    """
+    per_page = app.config["ADMIN_PAGE_SIZE"]
+    query = request.args.get("q", "")
+    sort = name_sort_arg()
+    players = search_players(
+        query, per_page + 1, request.args.get("after"), sort
+    )
+    following = len(players) > per_page
+    players = players[:per_page]
+    return render_template(
+        "includes/admin_players.html",
         players=players,
+        query=query,
+        sort=sort,
+        next_cursor=encode_player_cursor(players[-1]) if following else None,
+        more=bool(request.args.get("after")),
     )
 
 
@@ -474,8 +4544,8 @@ def add_score(category_id):
     POST: Gathers submitted score data and adds to the database.
     """
     if request.method == "POST":
-        # retrieve player_id from form
-        player_id = request.form.get("player_name")
+        # retrieve player name from form
+        player_name = request.form.get("player_name")
 
         # retireve all time data from form and convert into a string in the
         # format hours:minutes:seconds:centiseconds
@@ -493,37 +4563,51 @@ def add_score(category_id):
         score = string_to_centi(time_str)
 
         # find category and game from the database
-        category = mongo.db.categories.find_one_or_404(
-            {"_id": ObjectId(category_id)}
-        )
-        game = mongo.db.games.find_one_or_404(
-            {"_id": ObjectId(category["game_id"])}
-        )
+        category = find_category_or_404(category_id)
+        game = find_game_or_404(category["game_id"])
+
+        # find player, redirecting back if no player has the name
+        player = mongo.db.players.find_one({"name": player_name})
+        if player is None:
+            flash(f"There is no player named {player_name}.")
+            return redirect(url_for("add_score", category_id=category_id))
 
         # build dict object with user submitted data
         new_score = {
             "game_id": ObjectId(game["_id"]),
             "category_id": ObjectId(category["_id"]),
-            "player_id": ObjectId(player_id),
+            "player_id": ObjectId(player["_id"]),
             "score": score,
         }
 
-        # add score object to database and redirect to admin panel
-        mongo.db.scores.insert_one(new_score)
+        # add score object to database, update the leaderboard, tell live
+        # viewers about the change and redirect to admin panel. In compaction
+        # mode a run which isn't a personal best goes straight to the history
+        before = leaderboard_rows(category["_id"], [player["_id"]])
+        old = before.get(player["_id"])
+        if app.config["COMPACT_SCORES"] and old and old["score"] <= score:
+            mongo.db.score_history.insert_one(new_score)
+        else:
+            mongo.db.scores.insert_one(new_score)
+            if app.config["COMPACT_SCORES"]:
+                compact_runs(category["_id"], player["_id"])
+            add_leaderboard_score(new_score)
+            version = touch_board(new_score["category_id"])
+            page_cache.evict(new_score["category_id"])
+            rank_indexes.update(
+                category["_id"],
+                player["_id"],
+                min(score, old["score"]) if old else score,
+                version,
+            )
+            publish_board_changes(category["_id"], before, [player["_id"]])
+        record_player_run(new_score, old["score"] if old else None)
         flash("Score added.")
         return redirect(url_for("admin"))
 
     # find category and game from the database
-    category = mongo.db.categories.find_one_or_404(
-        {"_id": ObjectId(category_id)}
-    )
-    game = mongo.db.games.find_one_or_404(
-        {"_id": ObjectId(category["game_id"])}
-    )
-
-    # retrieve players list from database and sort by name
-    players = list(mongo.db.players.find())
-    players.sort(key=lambda x: x["name"])
+    category = find_category_or_404(category_id)
+    game = find_game_or_404(category["game_id"])
 
     return render_template(
         "add_score.html",
@@ -531,7 +4615,6 @@ def add_score(category_id):
         nav_links=nav_links(),
         category=category,
         game=game,
-        players=players,
     )
 
 
@@ -542,36 +4625,22 @@ def delete_scores(category_id):
     Renders the delete scores page for the given category.
     """
     # query the database for category and game
-    category = mongo.db.categories.find_one_or_404(
-        {"_id": ObjectId(category_id)}
-    )
-    game = mongo.db.games.find_one_or_404(
-        {"_id": ObjectId(category["game_id"])}
-    )
-
-    # retrieve list of all scores for the given category and game
-    scores = list(
-        mongo.db.scores.aggregate(
-            [
-                {
-                    "$match": {
-                        "game_id": ObjectId(game["_id"]),
-                        "category_id": ObjectId(category["_id"]),
-                    }
-                },
-                {
-                    "$lookup": {
-                        "from": "players",
-                        "localField": "player_id",
-                        "foreignField": "_id",
-                        "as": "player",
-                    }
-                },
-                {"$unwind": "$player"},
-                {"$sort": {"score": 1}},
-            ]
+    category = find_category_or_404(category_id)
+    game = find_game_or_404(category["game_id"])
+
+    # retrieve list of all scores for the given category and game, adding
+    # the superseded runs kept in the history if asked for
+    pipeline = category_scores_pipeline(game["_id"], category["_id"])
+    scores = list(mongo.db.scores.aggregate(pipeline))
+    history = request.args.get("history") == "1"
+    if history:
+        scores = list(
+            heapq.merge(
+                scores,
+                mongo.db.score_history.aggregate(pipeline),
+                key=lambda score: score["score"],
+            )
         )
-    )
     return render_template(
         "delete_scores.html",
         page_title="Delete Scores",
@@ -579,6 +4648,7 @@ def delete_scores(category_id):
         game=game,
         category=category,
         scores=scores,
+        history=history,
     )
 
 
@@ -588,18 +4658,239 @@ def delete_scores(category_id):
 def delete_score(score_id):
     """
     Adds a copy of the given score to the archive database and deletes the
-    score from the scores database.
+    score from the scores database, or from score_history if it is a
+    superseded run.
     """
     # find score
-    score = mongo.db.scores.find_one_or_404({"_id": ObjectId(score_id)})
+    score = mongo.db.scores.find_one({"_id": ObjectId(score_id)})
+    if score is None:
+        score = mongo.db.score_history.find_one_or_404(
+            {"_id": ObjectId(score_id)}
+        )
+        # a superseded run can't be on the current leaderboard, but it can
+        # be on historical ones, so their cached pages must go
+        mongo.db.archive.insert_one(score)
+        mongo.db.score_history.delete_one({"_id": score["_id"]})
+        drop_board_snapshots(score)
+        row = leaderboard_rows(score["category_id"], [score["player_id"]]).get(
+            score["player_id"]
+        )
+        version = touch_board(score["category_id"])
+        page_cache.evict(score["category_id"])
+        rank_indexes.update(
+            score["category_id"],
+            score["player_id"],
+            row and row["score"],
+            version,
+        )
+        rebuild_player_summary(score["player_id"], [score["category_id"]])
+        flash("Score deleted.")
+        return redirect(url_for("admin"))
 
-    # add score to the archive database and delete score from scores database
+    # add score to the archive database and delete score from scores
+    # database, replacing it with the player's next best run if it was kept
+    # in the history
     mongo.db.archive.insert_one(score)
-    mongo.db.scores.delete_one(score)
+    mongo.db.scores.delete_one({"_id": score["_id"]})
+    promote_best_run(score["category_id"], score["player_id"])
+    drop_board_snapshots(score)
+
+    # recalculate the player's leaderboard row if this was their best time,
+    # and tell live viewers about the change
+    before = leaderboard_rows(score["category_id"], [score["player_id"]])
+    row = before.get(score["player_id"])
+    best = row and row["score"]
+    if row is None or score["score"] <= row["score"]:
+        best = refresh_leaderboard_entry(
+            score["category_id"], score["player_id"]
+        )
+        publish_board_changes(
+            score["category_id"], before, [score["player_id"]]
+        )
+    version = touch_board(score["category_id"])
+    page_cache.evict(score["category_id"])
+    rank_indexes.update(
+        score["category_id"], score["player_id"], best, version
+    )
+    rebuild_player_summary(score["player_id"], [score["category_id"]])
     flash("Score deleted.")
     return redirect(url_for("admin"))
 
 
+@app.route("/import_scores", methods=["GET", "POST"])
+@post_restricted
+@login_required
+def import_scores_page():
+    """
+    GET: Renders the Import Scores page.
+    POST: Saves an uploaded CSV or NDJSON file to GridFS and imports its
+    scores in a background job. The file is kept in the database rather than
+    on disk, as the job may run in another process or on another machine.
+    """
+    if request.method == "POST":
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            flash("Please choose a file to import.")
+            return redirect(url_for("import_scores_page"))
+
+        # guess the file format from the file extension
+        file_format = (
+            "csv" if upload.filename.lower().endswith(".csv") else "ndjson"
+        )
+        file_id = gridfs.GridFS(mongo.db, collection="uploads").put(
+            upload.stream, filename=upload.filename
+        )
+        job_id = enqueue_job(
+            "import-scores",
+            f"Import scores from {upload.filename}",
+            file_id=file_id,
+            file_format=file_format,
+        )
+        return redirect(url_for("show_job", job_id=job_id))
+
+    return render_template(
+        "import_scores.html",
+        page_title="Import Scores",
+        nav_links=nav_links(),
+    )
+
+
+@app.route("/rebuild_leaderboards")
+@admin_only
+def rebuild_leaderboards_page():
+    """
+    Regenerates every category's leaderboard in a background job.
+    """
+    job_id = enqueue_job("rebuild-leaderboards", "Rebuild leaderboards")
+    return redirect(url_for("show_job", job_id=job_id))
+
+
+@app.route("/jobs")
+@login_required
+def jobs():
+    """
+    Renders a list of the most recent background jobs.
+    """
+    return render_template(
+        "jobs.html",
+        page_title="Jobs",
+        nav_links=nav_links(),
+        jobs=mongo.db.jobs.find().sort("created", -1).limit(50),
+    )
+
+
+def find_job_or_404(job_id):
+    """
+    Returns the job with the given id, or aborts with a 404 if there isn't
+    one.
+    """
+    try:
+        return mongo.db.jobs.find_one_or_404({"_id": ObjectId(job_id)})
+    except InvalidId:
+        abort(404)
+
+
+@app.route("/jobs/<job_id>")
+@login_required
+def show_job(job_id):
+    """
+    Renders a job's progress, which the page polls until the job finishes,
+    and its result.
+    """
+    return render_template(
+        "job.html",
+        page_title="Job",
+        nav_links=nav_links(),
+        job=find_job_or_404(job_id),
+    )
+
+
+@app.route("/jobs/<job_id>/status")
+@login_required
+def job_status(job_id):
+    """
+    Returns a job's state and progress as JSON.
+    """
+    job = find_job_or_404(job_id)
+    return jsonify(
+        {
+            "state": job["state"],
+            "attempts": job["attempts"],
+            "progress": job["progress"],
+            "error": job.get("error"),
+        }
+    )
+
+
+@app.route("/export/<game_name>/<category_name>/<kind>")
+@login_required
+def export_category(game_name, category_name, kind):
+    """
+    Streams the leaderboard or every run of the given category as a CSV or
+    NDJSON download, chosen with the format parameter.
+    """
+    if kind not in ("leaderboard", "runs"):
+        abort(404)
+    game = find_game_or_404(name=urllib.parse.unquote(game_name))
+    category = find_category_or_404(
+        game_id=game["_id"], name=urllib.parse.unquote(category_name)
+    )
+    if kind == "leaderboard":
+        records = export_leaderboard(category)
+    else:
+        records = export_runs(game, category)
+    return export_response(
+        kind,
+        records,
+        request.args.get("format", "csv"),
+        f"{game['name']}-{category['name']}-{kind}",
+    )
+
+
+@app.route("/export/archive")
+@login_required
+def export_archive_page():
+    """
+    Streams the archive of deleted games, categories, players and scores as a
+    CSV or NDJSON download, chosen with the format parameter.
+    """
+    return export_response(
+        "archive",
+        export_archive(),
+        request.args.get("format", "ndjson"),
+        "archive",
+    )
+
+
+@app.route("/players/search")
+@login_required
+def player_search():
+    """
+    Returns a page of the players whose names start with the q parameter,
+    ignoring case, as JSON, for the player pickers in the admin pages. The
+    next cursor, if any, is passed as after to fetch the following page.
+    """
+    limit = max(1, min(request.args.get("limit", 20, type=int), 100))
+    players = search_players(
+        request.args.get("q", ""), limit + 1, request.args.get("after")
+    )
+    following = len(players) > limit
+    players = players[:limit]
+    return jsonify(
+        {
+            "players": [
+                {
+                    "id": str(player["_id"]),
+                    "name": player["name"],
+                    "links": player["links"],
+                }
+                for player in players
+            ],
+            "next": encode_player_cursor(players[-1]) if following else None,
+        }
+    )
+
+
 @app.route("/add_player", methods=["GET", "POST"])
 @post_restricted
 @login_required
@@ -623,17 +4914,6 @@ def add_player():
         if youtube:
             youtube = "https://www.youtube.com/c/" + youtube
 
-        # check that the submitted name doesn't match any in the database
-        duplicate = mongo.db.players.find_one({"name": name})
-
-        # if name is already in the database, redirect back to add player page
-        if duplicate:
-            flash(
-                "That name is already in use. Please try again with a "
-                "different name."
-            )
-            return redirect(url_for("add_player"))
-
         # build dict with user submitted data and insert into players database
         new_player = {
             "name": name,
@@ -644,7 +4924,18 @@ def add_player():
             },
         }
 
-        mongo.db.players.insert_one(new_player)
+        # if name is already in the database, redirect back to add player page
+        try:
+            mongo.db.players.insert_one(
+                new_player
+            )
+        except DuplicateKeyError:
+            flash(
+                "That name is already in use. Please try again with a "
+                "different name."
+            )
+            return redirect(url_for("add_player"))
+        metadata_cache.invalidate()
         flash("New player added.")
         return redirect(url_for("admin"))
 
@@ -663,7 +4954,7 @@ def edit_player(player_id):
     GET: Renders the Edit Player page for the given player.
     POST: Gathers submitted player data and updates the players database.
     """
-    player = mongo.db.players.find_one_or_404({"_id": ObjectId(player_id)})
+    player = find_player_or_404(player_id)
     if request.method == "POST":
         # retrieve submitted data from form
         name = request.form.get("name")
@@ -671,16 +4962,6 @@ def edit_player(player_id):
         youtube = request.form.get("youtube")
         link = request.form.get("link")
 
-        # if the player name has changed, check it isn't a duplicate of another
-        # name in the database
-        if name != player["name"]:
-            duplicate_name = mongo.db.players.find_one({"name": name})
-            if duplicate_name:
-                flash("Duplicate name. Please try again.")
-                return redirect(
-                    url_for("edit_player", player_id=player["_id"])
-                )
-
         # if a twitch username was entered, convert into link
         if twitch:
             twitch = "https://www.twitch.tv/" + twitch
@@ -699,8 +4980,43 @@ def edit_player(player_id):
             },
         }
 
-        # update the player's database entry with the data
-        mongo.db.players.update_one(player, {"$set": edited_player})
+        # update the player's database entry with the data, redirecting back
+        # if the new name is a duplicate of another name in the database
+        try:
+            mongo.db.players.update_one(
+                {"_id": player["_id"]},
+                {"$set": edited_player},
+            )
+        except DuplicateKeyError:
+            flash("Duplicate name. Please try again.")
+            return redirect(url_for("edit_player", player_id=player["_id"]))
+        mongo.db.leaderboards.update_many(
+            {"player_id": player["_id"]}, {"$set": edited_player}
+        )
+        metadata_cache.invalidate()
+
+        # tell live viewers of every leaderboard the player is on
+        if edited_player != {"name": player["name"], "links": player["links"]}:
+            rows = mongo.db.leaderboards.find(
+                {"player_id": player["_id"]},
+                {"category_id": 1, "name": 1, "score": 1, "links": 1},
+            )
+            publish_board_events(
+                [
+                    {
+                        "category_id": row["category_id"],
+                        "type": "rows",
+                        "changes": [
+                            {
+                                "player_id": str(player["_id"]),
+                                "before": row["score"],
+                                "row": live_row(row),
+                            }
+                        ],
+                    }
+                    for row in rows
+                ]
+            )
         flash("Player updated.")
         return redirect(url_for("admin"))
 
@@ -720,23 +5036,16 @@ def delete_player(player_id):
     Adds a copy of the given player and their scores to the archive database
     and deletes them from the players and scores databases.
     """
-    # query the database for the player and their scores
-    player = mongo.db.players.find_one_or_404({"_id": ObjectId(player_id)})
-    scores = mongo.db.scores.find({"player_id": ObjectId(player_id)})
-
-    # copy the player object to a new dict and add the scores as a list
-    player_archive = player
-    player_archive["scores"] = list(scores)
-
-    # add the archive dict to the archive database
-    mongo.db.archive.insert_one(player_archive)
-
-    # delete the player and their scores from the players and scores databases
-    mongo.db.players.delete_one({"_id": ObjectId(player_id)})
-    mongo.db.scores.delete_many({"player_id": ObjectId(player_id)})
-
-    flash("Player and scores deleted.")
-    return redirect(url_for("admin"))
+    # check the player exists, then archive and delete it and its scores in
+    # a background job
+    player = find_player_or_404(player_id)
+    job_id = enqueue_job(
+        "cascade-delete",
+        f"Delete player {player['name']}",
+        kind="player",
+        target_id=player["_id"],
+    )
+    return redirect(url_for("show_job", job_id=job_id))
 
 
 @app.route("/add_game", methods=["GET", "POST"])
@@ -751,19 +5060,19 @@ def add_game():
         # retrieve game name from form and replace spaces with underscores
         name = display_to_url(request.form.get("name"))
 
-        # check if the game name is already in use in the database
-        duplicate = mongo.db.games.find_one({"name": name})
-        if duplicate:
+        # Add the game name to a dict and then add to games database,
+        # redirecting back if the game name is already in use
+        new_game = {
+            "name": name,
+        }
+        try:
+            mongo.db.games.insert_one(new_game)
+        except DuplicateKeyError:
             flash(
                 "The submitted game name is already in use. Please try again."
             )
             return redirect(url_for("add_game"))
-
-        # Add the game name to a dict and then add to games database
-        new_game = {
-            "name": name,
-        }
-        mongo.db.games.insert_one(new_game)
+        metadata_cache.invalidate()
         flash("Game added.")
         return redirect(url_for("admin"))
 
@@ -783,22 +5092,24 @@ def edit_game(game_id):
     POST: Gathers submitted game data and adds to the games database.
     """
     # find the requested game in the database
-    game = mongo.db.games.find_one_or_404({"_id": ObjectId(game_id)})
+    game = find_game_or_404(game_id)
     if request.method == "POST":
         # retrieve game name from form and replace spaces with underscores
         name = display_to_url(request.form.get("name"))
 
-        # check if the game name is already in use in the database
-        duplicate_name = mongo.db.games.find_one({"name": name})
-        if duplicate_name:
-            flash("Duplicate name. Please try again.")
-            return redirect(url_for("edit_game", game_id=game["_id"]))
-
-        # Add the game name to a dict and then update the games database
+        # Add the game name to a dict and then update the games database,
+        # redirecting back if the game name is already in use
         edited_game = {
             "name": name,
         }
-        mongo.db.games.update_one(game, {"$set": edited_game})
+        try:
+            mongo.db.games.update_one(
+                {"_id": game["_id"]}, {"$set": edited_game}
+            )
+        except DuplicateKeyError:
+            flash("Duplicate name. Please try again.")
+            return redirect(url_for("edit_game", game_id=game["_id"]))
+        metadata_cache.invalidate()
         flash("Game updated.")
         return redirect(url_for("admin"))
 
@@ -819,27 +5130,16 @@ def delete_game(game_id):
     archive database, then deletes them from the games, categories and scores
     databases.
     """
-    # find game and all categories and scores for the game in the database
-    game = mongo.db.games.find_one_or_404({"_id": ObjectId(game_id)})
-    categories = mongo.db.categories.find({"game_id": ObjectId(game_id)})
-    scores = mongo.db.scores.find({"game_id": ObjectId(game_id)})
-
-    # copy the game object to a new dict and then add the categories and scores
-    # as lists
-    game_archive = game
-    game_archive["categories"] = list(categories)
-    game_archive["scores"] = list(scores)
-
-    # add the archive dict to the archive database, then delete the game and
-    # all its categories and scores from the games, categories and scores
-    # databases
-    mongo.db.archive.insert_one(game_archive)
-    mongo.db.games.delete_one({"_id": ObjectId(game_id)})
-    mongo.db.categories.delete_many({"game_id": ObjectId(game_id)})
-    mongo.db.scores.delete_many({"game_id": ObjectId(game_id)})
-
-    flash("Game, categories and scores deleted.")
-    return redirect(url_for("admin"))
+    # check the game exists, then archive and delete it and all of its
+    # categories and scores in a background job
+    game = find_game_or_404(game_id)
+    job_id = enqueue_job(
+        "cascade-delete",
+        f"Delete game {url_to_display(game['name'])}",
+        kind="game",
+        target_id=game["_id"],
+    )
+    return redirect(url_for("show_job", job_id=job_id))
 
 
 @app.route("/add_category", methods=["GET", "POST"])
@@ -855,14 +5155,6 @@ def add_category():
         game_id = request.form.get("game_id")
         name = display_to_url(request.form.get("name"))
 
-        # check if the given game already has a category with the given name
-        duplicate = mongo.db.categories.find_one(
-            {"name": name, "game_id": ObjectId(game_id)}
-        )
-        if duplicate:
-            flash("Duplicate category name. Please try again.")
-            return redirect(url_for("add_category", id=game_id))
-
         # retrieve the category description
         desc = request.form.get("desc")
 
@@ -872,11 +5164,17 @@ def add_category():
             "name": name,
             "desc": desc,
         }
-        mongo.db.categories.insert_one(new_category)
+        # redirect back if the game already has a category with this name
+        try:
+            mongo.db.categories.insert_one(new_category)
+        except DuplicateKeyError:
+            flash("Duplicate category name. Please try again.")
+            return redirect(url_for("add_category", id=game_id))
+        metadata_cache.invalidate()
         flash("Category added.")
         return redirect(url_for("admin"))
 
-    games = list(mongo.db.games.find())
+    games = all_games()
     return render_template(
         "add_category.html",
         page_title="Add Category",
@@ -894,32 +5192,14 @@ def edit_category(game_id, category_id):
     POST: Gathers submitted category data and adds to the categories database.
     """
     # find the requested game and category in the database
-    mongo.db.games.find_one_or_404({"_id": ObjectId(game_id)})
-    category = mongo.db.categories.find_one_or_404(
-        {"_id": ObjectId(category_id)}
-    )
+    find_game_or_404(game_id)
+    category = find_category_or_404(category_id)
 
     if request.method == "POST":
         # retrieve the game_id and category name from the form
         game_id = request.form.get("game_id")
         name = display_to_url(request.form.get("name"))
 
-        # if the name has changed, check that it doesn't match other categories
-        if name != category["name"]:
-            duplicate = mongo.db.categories.find_one(
-                {"name": name, "game_id": ObjectId(game_id)}
-            )
-
-            if duplicate:
-                flash("Duplicate category name. Please try again.")
-                return redirect(
-                    url_for(
-                        "edit_category",
-                        game_id=game_id,
-                        category_id=category_id,
-                    )
-                )
-
         # retrieve the category description
         desc = request.form.get("desc")
 
@@ -930,11 +5210,29 @@ def edit_category(game_id, category_id):
             "desc": desc,
         }
 
-        mongo.db.categories.update_one(category, {"$set": updated_category})
+        # redirect back if the name matches another of the game's categories
+        try:
+            mongo.db.categories.update_one(
+                {"_id": category["_id"]}, {"$set": updated_category}
+            )
+        except DuplicateKeyError:
+            flash("Duplicate category name. Please try again.")
+            return redirect(
+                url_for(
+                    "edit_category",
+                    game_id=game_id,
+                    category_id=category_id,
+                )
+            )
+        mongo.db.leaderboards.update_many(
+            {"category_id": category["_id"]},
+            {"$set": {"game_id": ObjectId(game_id)}},
+        )
+        metadata_cache.invalidate()
         flash("Category updated.")
         return redirect(url_for("admin"))
 
-    games = list(mongo.db.games.find())
+    games = all_games()
     return render_template(
         "edit_category.html",
         page_title="Edit Category",
@@ -953,25 +5251,125 @@ def delete_category(category_id):
     Adds a copy of the given category and all of its scores to the archive
     database, then deletes them from the categories and scores databases.
     """
-    # find category and all scores under that category
-    category = mongo.db.categories.find_one_or_404(
-        {"_id": ObjectId(category_id)}
+    # check the category exists, then archive and delete it and its scores
+    # in a background job
+    category = find_category_or_404(category_id)
+    job_id = enqueue_job(
+        "cascade-delete",
+        f"Delete category {url_to_display(category['name'])}",
+        kind="category",
+        target_id=category["_id"],
+    )
+    return redirect(url_for("show_job", job_id=job_id))
+
+
+@app.route("/cache_stats")
+@admin_only
+def cache_stats():
+    """
+    Returns the hit and miss counters of the metadata, page and rank index
+    caches, and the page and rank index caches' sizes, as JSON.
+    """
+    return jsonify(
+        {
+            "metadata": metadata_cache.stats(),
+            "pages": page_cache.stats(),
+            "ranks": rank_indexes.stats(),
+        }
     )
-    scores = mongo.db.scores.find({"category_id": ObjectId(category_id)})
 
-    # add category and all scores to archive dict
-    category_archive = category
-    category_archive["scores"] = list(scores)
 
-    # add archive dict to archive collection
-    mongo.db.archive.insert_one(category_archive)
+@app.route("/profiles")
+@admin_only
+def profiles():
+    """
+    Renders a list of the saved request profiles, newest first.
+    """
+    reports = []
+    for report_id in reversed(profile_ids()):
+        with open(profile_path(report_id, "json")) as stream:
+            reports.append(json.load(stream))
+    return render_template(
+        "profiles.html",
+        page_title="Request Profiles",
+        nav_links=nav_links(),
+        reports=reports,
+    )
 
-    # delete category and scores
-    mongo.db.categories.delete_one({"_id": ObjectId(category_id)})
-    mongo.db.scores.delete_many({"category_id": ObjectId(category_id)})
 
-    flash("Categories and scores deleted.")
-    return redirect(url_for("admin"))
+@app.route("/profiles/<report_id>")
+@admin_only
+def profile_report(report_id):
+    """
+    Renders the functions that took the most time in a profiled request,
+    sorted by the sort parameter.
+    """
+    sort = request.args.get("sort", "cumulative")
+    if sort not in ("cumulative", "tottime", "ncalls"):
+        abort(400)
+    with open(profile_path(report_id, "json")) as stream:
+        report = json.load(stream)
+    output = io.StringIO()
+    stats = pstats.Stats(profile_path(report_id, "prof"), stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(60)
+    return render_template(
+        "profile_report.html",
+        page_title="Request Profile",
+        nav_links=nav_links(),
+        report=report,
+        sort=sort,
+        stats=output.getvalue(),
+    )
+
+
+@app.route("/profiles/<report_id>/download")
+@admin_only
+def download_profile(report_id):
+    """
+    Downloads a request's raw profile, for tools such as snakeviz.
+    """
+    return send_file(
+        profile_path(report_id, "prof"),
+        mimetype="application/octet-stream",
+        as_attachment=True,
+        download_name=f"{report_id}.prof",
+    )
+
+
+def metrics_allowed():
+    """
+    Returns True if the admin is logged in or the client's IP address is in
+    one of the networks listed in METRICS_ALLOWED_IPS, which is empty unless
+    set.
+    """
+    if session.get("user") == "admin":
+        return True
+    if not app.config["METRICS_ALLOWED_IPS"]:
+        return False
+    try:
+        address = ipaddress.ip_address(request.remote_addr)
+    except ValueError:
+        return False
+    return any(
+        address in network for network in app.config["METRICS_ALLOWED_IPS"]
+    )
+
+
+@app.route("/metrics")
+def metrics():
+    """
+    Returns the app's metrics in the Prometheus text format, added up across
+    every gunicorn worker when PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    if not metrics_allowed():
+        abort(403)
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    response = make_response(generate_latest(registry))
+    response.headers["Content-Type"] = CONTENT_TYPE_LATEST
+    return response
 
 
 @app.errorhandler(404)
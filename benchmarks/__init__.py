@@ -0,0 +1,7 @@
+"""
+Benchmark suite for SpeedLeague. Generates a reproducible, seeded data set,
+drives the Flask test client against the main routes and records latency
+percentiles, database query counts and peak memory for each of them.
+
+Run from the project directory with python -m benchmarks --help.
+"""
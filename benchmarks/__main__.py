@@ -0,0 +1,213 @@
+"""
+Command line entry point for the benchmark suite, e.g.
+
+    python -m benchmarks --in-memory --save baseline.json
+    python -m benchmarks --in-memory --compare baseline.json
+"""
+import json
+import os
+import platform
+import sys
+
+import click
+from pymongo.collection import Collection
+from pymongo.uri_parser import parse_uri
+
+
+@click.command()
+@click.option(
+    "--mongo-uri",
+    default="mongodb://localhost:27017/speedleague_bench",
+    show_default=True,
+    help="Database to benchmark against. It must be empty unless --reuse "
+    "or --drop is given.",
+)
+@click.option(
+    "--in-memory",
+    is_flag=True,
+    help="Use the in-memory mongomock stand-in instead of a mongod.",
+)
+@click.option(
+    "--reuse", is_flag=True, help="Benchmark data already in the database."
+)
+@click.option(
+    "--drop", is_flag=True, help="Drop the database before generating data."
+)
+@click.option("--games", default=5, show_default=True)
+@click.option(
+    "--categories", default=4, show_default=True, help="Categories per game."
+)
+@click.option("--players", default=2000, show_default=True)
+@click.option(
+    "--runs", default=20, show_default=True, help="Mean runs per player."
+)
+@click.option("--seed", default=0, show_default=True)
+@click.option(
+    "--repeat", default=20, show_default=True, help="Timed runs per case."
+)
+@click.option("--warm", is_flag=True, help="Keep the app's caches warm.")
+@click.option(
+    "--case",
+    "case_names",
+    multiple=True,
+    help="Only run the named case. Can be given more than once.",
+)
+@click.option("--save", type=click.Path(), help="Save the results as JSON.")
+@click.option(
+    "--compare",
+    type=click.Path(exists=True),
+    help="Compare with saved results and fail on regressions.",
+)
+@click.option(
+    "--threshold",
+    default=0.25,
+    show_default=True,
+    help="Fraction by which latency or memory may grow before failing.",
+)
+def main(
+    mongo_uri,
+    in_memory,
+    reuse,
+    drop,
+    games,
+    categories,
+    players,
+    runs,
+    seed,
+    repeat,
+    warm,
+    case_names,
+    save,
+    compare,
+    threshold,
+):
+    """
+    Benchmarks the SpeedLeague routes against a seeded synthetic data set.
+    """
+    database_name = parse_uri(mongo_uri)["database"] or "speedleague_bench"
+    # the app needs these to import, but the database is replaced below
+    os.environ.setdefault("MONGO_URI", mongo_uri)
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+
+    import app as speedleague
+    from benchmarks import data, runner
+
+    collection_types = (Collection,)
+    if in_memory:
+        try:
+            import mongomock
+        except ImportError:
+            raise click.ClickException(
+                "--in-memory needs mongomock: pip install mongomock"
+            )
+        from flask_pymongo import wrappers
+
+        mongomock.Collection.find_one_or_404 = (
+            wrappers.Collection.find_one_or_404
+        )
+        # mongomock can't create capped collections, which the benchmarks
+        # don't tail, so create ordinary ones instead
+        create_collection = mongomock.Database.create_collection
+
+        def create_uncapped(self, name, capped=False, size=None, **kwargs):
+            return create_collection(self, name, **kwargs)
+
+        mongomock.Database.create_collection = create_uncapped
+        client = mongomock.MongoClient()
+        collection_types += (mongomock.Collection,)
+    else:
+        from flask_pymongo.wrappers import MongoClient
+
+        client = MongoClient(mongo_uri)
+    database = client[database_name]
+
+    if drop:
+        client.drop_database(database_name)
+    if not reuse and database.list_collection_names():
+        raise click.ClickException(
+            f"Database {database_name} is not empty. Use --reuse to "
+            "benchmark its data or --drop to replace it."
+        )
+
+    counter = runner.QueryCounter()
+    speedleague.mongo.cx = client
+    speedleague.mongo.db = runner.CountingDatabase(
+        database, counter, collection_types
+    )
+    config = {
+        "in_memory": in_memory,
+        "warm": warm,
+        "games": games,
+        "categories": categories,
+        "players": players,
+        "runs": runs,
+        "seed": seed,
+    }
+
+    with speedleague.app.app_context():
+        if not reuse:
+            counts = data.generate(games, categories, players, runs, seed)
+            click.echo(
+                "Generated {games} games, {categories} categories, "
+                "{players} players and {scores} scores.".format(**counts)
+            )
+
+        test_client = speedleague.app.test_client()
+        with test_client.session_transaction() as session:
+            session["user"] = "admin"
+        cases = runner.build_cases(test_client)
+        unknown = set(case_names) - set(cases)
+        if unknown:
+            raise click.BadParameter(
+                f"Unknown case {', '.join(sorted(unknown))}. Choose from "
+                f"{', '.join(cases)}.",
+                param_hint="--case",
+            )
+
+        results = {}
+        click.echo(
+            f"{'case':<20}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+            f"{'queries':>9}{'peak KiB':>11}"
+        )
+        for name, case in cases.items():
+            if case_names and name not in case_names:
+                continue
+            result = runner.measure(case, counter, repeat, warm)
+            results[name] = result
+            click.echo(
+                f"{name:<20}{result['p50_ms']:>10}{result['p90_ms']:>10}"
+                f"{result['p99_ms']:>10}{result['queries']:>9}"
+                f"{result['peak_kib']:>11}"
+            )
+
+    if save:
+        with open(save, "w") as stream:
+            json.dump(
+                {
+                    "config": config,
+                    "python": platform.python_version(),
+                    "results": results,
+                },
+                stream,
+                indent=2,
+            )
+        click.echo(f"Saved results to {save}.")
+
+    if compare:
+        with open(compare) as stream:
+            baseline = json.load(stream)
+        if baseline["config"] != config:
+            click.echo(
+                "Warning: the baseline was recorded with different settings "
+                f"{baseline['config']}."
+            )
+        regressions = runner.compare(results, baseline, threshold)
+        for regression in regressions:
+            click.echo(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        click.echo("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
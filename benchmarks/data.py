@@ -0,0 +1,104 @@
+"""
+Seeded generator of synthetic SpeedLeague data with realistic shapes.
+"""
+import random
+
+from werkzeug.security import generate_password_hash
+
+import app as speedleague
+
+BATCH_SIZE = 10000
+
+
+def generate(games, categories, players, runs, seed=0):
+    """
+    Fills the app's database with the given number of games, categories per
+    game and players. The number of runs each player has submitted is long
+    tailed with a mean of runs, so most players have a few runs and a few
+    players have hundreds. Players concentrate on a small number of
+    categories, and the first categories of each game are the most popular,
+    as on a real leaderboard. Must be called inside an app context. Returns
+    a dict of counts of the generated documents.
+    """
+    rng = random.Random(seed)
+    db = speedleague.mongo.db
+
+    db.users.insert_one(
+        {"username": "admin", "password": generate_password_hash("admin")}
+    )
+    game_ids = db.games.insert_many(
+        [{"name": f"Game_{i}"} for i in range(games)]
+    ).inserted_ids
+    category_docs = [
+        {"game_id": game_id, "name": f"Category_{i}", "desc": ""}
+        for game_id in game_ids
+        for i in range(categories)
+    ]
+    db.categories.insert_many(category_docs)
+    player_ids = db.players.insert_many(
+        [
+            {
+                "name": f"Player_{i:06d}",
+                "links": {"twitch": "", "youtube": "", "link": ""},
+            }
+            for i in range(players)
+        ]
+    ).inserted_ids
+    speedleague.ensure_indexes()
+
+    # earlier categories of each game are more popular, like Any% and 100%
+    weights = [1 / (i % categories + 1) for i in range(len(category_docs))]
+    # each category has a par time that the best players get close to
+    pars = [rng.randint(6000, 720000) for category in category_docs]
+
+    batch = []
+    total = 0
+    for player_id in player_ids:
+        # a Pareto distribution with shape 1.5 has a mean of 3
+        count = max(1, round(rng.paretovariate(1.5) * runs / 3))
+        played = set(
+            rng.choices(
+                range(len(category_docs)),
+                weights,
+                k=min(1 + int(rng.expovariate(1)), len(category_docs)),
+            )
+        )
+        skill = 1 + rng.expovariate(3)
+        for run in range(count):
+            index = rng.choice(sorted(played))
+            # players get faster the more runs they submit
+            improvement = 1 - 0.1 * run / count
+            batch.append(
+                {
+                    "game_id": category_docs[index]["game_id"],
+                    "category_id": category_docs[index]["_id"],
+                    "player_id": player_id,
+                    "score": int(
+                        pars[index]
+                        * skill
+                        * improvement
+                        * (1 + rng.random() * 0.05)
+                    ),
+                }
+            )
+            if len(batch) >= BATCH_SIZE:
+                db.scores.insert_many(batch)
+                total += len(batch)
+                batch = []
+    if batch:
+        db.scores.insert_many(batch)
+        total += len(batch)
+
+    for category in category_docs:
+        speedleague.rebuild_leaderboard(category)
+    # in compaction mode, keep only personal bests in the scores collection
+    if speedleague.app.config["COMPACT_SCORES"]:
+        speedleague.compact_scores()
+    speedleague.rebuild_player_summaries()
+    speedleague.metadata_cache.invalidate()
+    return {
+        "games": games,
+        "categories": len(category_docs),
+        "players": players,
+        "scores": total,
+    }
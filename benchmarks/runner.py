@@ -0,0 +1,220 @@
+"""
+Runs benchmark cases against the app with the Flask test client and compares
+the results with a saved baseline.
+"""
+import math
+import time
+import tracemalloc
+
+from pymongo.collection import Collection
+
+import app as speedleague
+
+# collection methods which send a query or write to the database
+OPERATIONS = {
+    "aggregate",
+    "bulk_write",
+    "count_documents",
+    "delete_many",
+    "delete_one",
+    "distinct",
+    "estimated_document_count",
+    "find",
+    "find_one",
+    "find_one_and_update",
+    "find_one_or_404",
+    "insert_many",
+    "insert_one",
+    "replace_one",
+    "update_many",
+    "update_one",
+}
+
+
+class QueryCounter:
+    """
+    Counts the database operations made through a CountingDatabase.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+
+class CountingCollection:
+    """
+    Wraps a collection and counts each query or write made through it. A
+    cursor counts as one query however many batches it fetches.
+    """
+
+    def __init__(self, collection, counter):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        value = getattr(self._collection, name)
+        if name not in OPERATIONS:
+            return value
+
+        def counted(*args, **kwargs):
+            self._counter.count += 1
+            return value(*args, **kwargs)
+
+        return counted
+
+
+class CountingDatabase:
+    """
+    Wraps a database so that every collection read from it counts its
+    queries. Works with pymongo and with the in-memory stand-in.
+    """
+
+    def __init__(self, database, counter, collection_types=(Collection,)):
+        self._database = database
+        self._counter = counter
+        self._collection_types = collection_types
+
+    def __getattr__(self, name):
+        value = getattr(self._database, name)
+        if isinstance(value, self._collection_types):
+            return CountingCollection(value, self._counter)
+        return value
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name], self._counter)
+
+
+def percentile(values, percent):
+    """
+    Returns the given percentile of a list of numbers using the nearest rank
+    method.
+    """
+    ordered = sorted(values)
+    rank = math.ceil(percent / 100 * len(ordered))
+    return ordered[max(0, rank - 1)]
+
+
+def clear_caches():
+    """
+    Empties the app's in-process caches, so the next request reads everything
+    from the database.
+    """
+    speedleague.metadata_cache.clear()
+    speedleague.page_cache.clear()
+    speedleague.rank_indexes.clear()
+
+
+def build_cases(client):
+    """
+    Returns a dict of benchmark cases, each a function which makes one request
+    or call. The leaderboard cases use the category with the most players.
+    """
+    db = speedleague.mongo.db
+    biggest = next(
+        db.leaderboards.aggregate(
+            [
+                {"$group": {"_id": "$category_id", "rows": {"$sum": 1}}},
+                {"$sort": {"rows": -1, "_id": 1}},
+                {"$limit": 1},
+            ]
+        )
+    )
+    category = db.categories.find_one({"_id": biggest["_id"]})
+    game = db.games.find_one({"_id": category["game_id"]})
+    middle = next(
+        db.leaderboards.find({"category_id": category["_id"]})
+        .sort([("score", 1), ("player_id", 1)])
+        .skip(biggest["rows"] // 2)
+        .limit(1)
+    )
+    board = f"/{game['name']}/{category['name']}"
+
+    def get(path):
+        def request():
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f"GET {path} returned {response.status}")
+
+        return request
+
+    def nav_links():
+        with speedleague.app.test_request_context():
+            speedleague.load_nav_links()
+
+    return {
+        "nav_links": nav_links,
+        "show_scores": get(board),
+        "show_scores_around": get(f"{board}?around={middle['name']}"),
+        "player_search": get("/players/search?q=player_0001"),
+        "player_page": get(f"/players/{middle['name']}"),
+        "api_leaderboard": get(f"/api{board}/leaderboard"),
+        "api_rank": get(
+            f"/api{board}/rank?player={middle['name']}&time=0:01:00.00"
+        ),
+        "admin": get("/admin"),
+        "admin_games": get("/admin/games?view=scores"),
+        "admin_categories": get(
+            f"/admin/games/{game['_id']}/categories?view=scores"
+        ),
+        "admin_players": get("/admin/players"),
+        "delete_scores": get(f"/delete_scores/{category['_id']}"),
+    }
+
+
+def measure(case, counter, repeat, warm=False):
+    """
+    Runs a benchmark case repeat times and returns its latency percentiles in
+    milliseconds, the number of queries it made and its peak memory use in
+    KiB. Caches are cleared before each run unless warm is set.
+    """
+    # run once first so template compilation isn't timed
+    case()
+    timings = []
+    queries = 0
+    for run in range(repeat):
+        if not warm:
+            clear_caches()
+        counter.count = 0
+        start = time.perf_counter()
+        case()
+        timings.append((time.perf_counter() - start) * 1000)
+        queries = max(queries, counter.count)
+
+    # tracemalloc slows everything down, so measure memory in a separate run
+    if not warm:
+        clear_caches()
+    tracemalloc.start()
+    case()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p90_ms": round(percentile(timings, 90), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "mean_ms": round(sum(timings) / len(timings), 3),
+        "queries": queries,
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares results with a saved baseline and returns a list of
+    regressions. A case regresses if its median latency or peak memory grew
+    by more than the threshold fraction, or if it makes more queries.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        for key in ("p50_ms", "peak_kib"):
+            if result[key] > base[key] * (1 + threshold):
+                regressions.append(
+                    f"{name}: {key} {base[key]} -> {result[key]}"
+                )
+        if result["queries"] > base["queries"]:
+            regressions.append(
+                f"{name}: queries {base['queries']} -> {result['queries']}"
+            )
+    return regressions
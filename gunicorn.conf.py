@@ -0,0 +1,41 @@
+"""
+Gunicorn settings. Gives the workers a shared directory for their Prometheus
+metrics, so that /metrics reports the totals of every worker rather than
+just the worker which happens to handle the request, and uses threaded
+workers so that live leaderboard streams don't tie up a worker each.
+"""
+import os
+import shutil
+import tempfile
+
+# must be set before prometheus_client is imported by this file or the app
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "speedleague-metrics"),
+)
+
+from prometheus_client import multiprocess  # noqa: E402
+
+# a sync worker handles one request at a time, so every open live leaderboard
+# stream would hold a whole worker. gthread workers serve each request from
+# one of a pool of threads, which keeps the background job runner and
+# request profiling working. gevent workers hold many more idle streams, but
+# the app then leaves jobs to flask run-jobs and refuses to profile
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+
+def on_starting(server):
+    """
+    Removes any metrics left behind by a previous run.
+    """
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    """
+    Stops reporting the live gauges of a worker which has exited.
+    """
+    multiprocess.mark_process_dead(worker.pid)
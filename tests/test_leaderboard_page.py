@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/speedleague")
+os.environ.setdefault("SECRET_KEY", "test")
+
+import app as speedleague  # noqa: E402
+
+
+@pytest.fixture
+def category_id(monkeypatch):
+    db = mongomock.MongoClient().speedleague
+    monkeypatch.setattr(speedleague.mongo, "db", db)
+    speedleague.metadata_cache.clear()
+    category_id = db.categories.insert_one({"name": "Any"}).inserted_id
+    for score, name in enumerate(["ann", "bob", "cat", "dan", "eve"]):
+        player_id = db.players.insert_one({"name": name}).inserted_id
+        db.leaderboards.insert_one(
+            {
+                "category_id": category_id,
+                "player_id": player_id,
+                "name": name,
+                "score": 1000 + score,
+                "links": {},
+            }
+        )
+    yield category_id
+    speedleague.metadata_cache.clear()
+
+
+@pytest.mark.parametrize(
+    "per_page, names",
+    [(1, ["cat"]), (2, ["bob", "cat"]), (3, ["bob", "cat", "dan"])],
+)
+def test_around_page_is_never_longer_than_per_page(
+    category_id, per_page, names
+):
+    with speedleague.app.app_context():
+        page = speedleague.leaderboard_page(
+            category_id, per_page, around="cat"
+        )
+    assert [row.name for row in page["rows"]] == names
+
+
+def test_read_leaderboard_rows_reads_nothing_for_no_rows(category_id):
+    assert speedleague.read_leaderboard_rows(category_id, limit=0) == []